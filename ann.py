@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+import numpy as np
+import conf
+
+index_brute_force_threshold = int(conf.get_prop('index', 'brute_force_threshold', '4096'))
+index_nlist = int(conf.get_prop('index', 'nlist', '0'))
+index_nprobe = int(conf.get_prop('index', 'nprobe', '8'))
+index_compact_fraction = float(conf.get_prop('index', 'compact_fraction', '0.25'))
+index_checkpoint = conf.get_prop('index', 'checkpoint', 'employee_index.npz')
+index_checkpoint_interval = float(conf.get_prop('index', 'checkpoint_interval', '60'))
+index_poll_interval = float(conf.get_prop('index', 'poll_interval', '30'))
+index_reload_interval = float(conf.get_prop('index', 'reload_interval', '5'))
+
+
+class _Rows(object):
+    """
+    Growable contiguous float32 matrix with amortized O(1) appends
+    """
+
+    def __init__(self, dim=128, capacity=64):
+        self.data = np.empty((capacity, dim), dtype=np.float32)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    @classmethod
+    def wrap(cls, matrix):
+        """
+        Use a matrix as the rows without copying it, e.g. a memory-mapped one. It is copied on the first append.
+        """
+        rows = cls.__new__(cls)
+        rows.data = matrix
+        rows.ids = np.arange(len(matrix), dtype=np.int64)
+        rows.size = len(matrix)
+
+        return rows
+
+    def append(self, row_id, vector):
+        if self.size == len(self.data):
+            self.data = np.concatenate([self.data, np.empty_like(self.data)])
+            self.ids = np.concatenate([self.ids, np.empty_like(self.ids)])
+
+        self.data[self.size] = vector
+        self.ids[self.size] = row_id
+        self.size += 1
+
+    def view(self):
+        return self.data[:self.size], self.ids[:self.size]
+
+
+def _sq_distances(queries, vectors):
+    d = np.einsum('ij,ij->i', queries, queries)[:, np.newaxis] + \
+        np.einsum('ij,ij->i', vectors, vectors) - 2 * np.dot(queries, vectors.T)
+
+    return np.maximum(d, 0, out=d)
+
+
+def _kmeans(vectors, k, iterations=10, seed=0):
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = np.argmin(_sq_distances(vectors, centroids), axis=1)
+
+        for c in range(k):
+            members = vectors[assignment == c]
+            if len(members) > 0:
+                centroids[c] = members.mean(axis=0)
+            else:
+                # restart an empty cluster on a random vector
+                centroids[c] = vectors[rng.randint(len(vectors))]
+
+    return centroids
+
+
+class EmployeeIndex(object):
+
+    def __init__(self, brute_force_threshold=index_brute_force_threshold, nlist=index_nlist, nprobe=index_nprobe,
+                 compact_fraction=index_compact_fraction):
+        """
+        Approximate nearest neighbour index over the face encodings of all employees. It is an inverted file (IVF)
+        index: encodings are partitioned by a k-means coarse quantizer and a query only scans the `nprobe` nearest
+        partitions. Small sets are searched exhaustively.
+        :param brute_force_threshold: min number of encodings to build the inverted file
+        :param nlist: number of partitions, 0 picks about the square root of the number of encodings
+        :param nprobe: number of partitions scanned by a query
+        :param compact_fraction: the rows of replaced encodings are dropped once they are this fraction of the rows
+        """
+        self.brute_force_threshold = brute_force_threshold
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.compact_fraction = compact_fraction
+
+        # employee no and deleted flag of each row
+        self.labels = []
+        self.deleted = []
+        self.deleted_count = 0
+
+        # employee id -> row
+        self.rows = {}
+
+        self.centroids = None
+        self.partitions = [_Rows()]
+
+        # largest employee id indexed, a checkpoint is completed by the employees added after it
+        self.max_employee_id = 0
+
+        # incremented by every change
+        self.version = 0
+
+        # time a checkpoint loaded started to be written, the encodings changed since then are not in it
+        self.created = None
+
+        # queries run on worker threads while encodings are inserted on the reactor thread
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, employee_id):
+        return employee_id in self.rows
+
+    def build(self, ids, nos, encodings, centroids=None):
+        """
+        Replace the content of the index
+        :param ids: employee ids
+        :param nos: employee nos
+        :param encodings: 128-dimensional face encodings of the employees
+        :param centroids: centroids of the partitions, e.g. of a checkpoint. None runs k-means if there are
+                          enough encodings
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+
+        if centroids is None and len(encodings) >= self.brute_force_threshold:
+            nlist = self.nlist or max(1, int(np.sqrt(len(encodings))))
+            centroids = _kmeans(encodings, nlist)
+
+        if centroids is None:
+            partitions = [_Rows.wrap(encodings) if len(encodings) > 0 else _Rows()]
+        else:
+            partitions = [_Rows() for _ in range(len(centroids))]
+            assignment = np.argmin(_sq_distances(encodings, centroids), axis=1)
+
+            for row, (encoding, p) in enumerate(zip(encodings, assignment)):
+                partitions[p].append(row, encoding)
+
+        with self._lock:
+            self.labels = list(nos)
+            self.deleted = [False] * len(self.labels)
+            self.deleted_count = 0
+            self.rows = dict((employee_id, row) for row, employee_id in enumerate(ids))
+            self.centroids = centroids
+            self.partitions = partitions
+            self.max_employee_id = max([self.max_employee_id] + list(ids))
+            self.version += 1
+
+        print('Built employee index of {} encodings in {} partitions'.format(len(encodings), len(partitions)))
+
+    def add(self, employee_id, employee_no, encoding):
+        """
+        Insert the encoding of an employee, it replaces the previous encoding of the employee if any
+        """
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(128)
+
+        with self._lock:
+            if employee_id in self.rows:
+                self.deleted[self.rows[employee_id]] = True
+                self.deleted_count += 1
+
+            row = len(self.labels)
+            self.labels.append(employee_no)
+            self.deleted.append(False)
+            self.rows[employee_id] = row
+
+            p = 0 if self.centroids is None else \
+                int(np.argmin(_sq_distances(encoding[np.newaxis], self.centroids)[0]))
+            self.partitions[p].append(row, encoding)
+
+            self.max_employee_id = max(self.max_employee_id, employee_id)
+            self.version += 1
+
+            if self.deleted_count > self.compact_fraction * len(self.labels):
+                self._compact()
+
+    def _compact(self):
+        """
+        Drop the rows of replaced encodings and renumber the others, the partitions are kept.
+        Called with the lock held
+        """
+        deleted = np.array(self.deleted, dtype=bool)
+        keep = np.flatnonzero(~deleted)
+
+        # old row -> new row
+        renumber = np.empty(len(deleted), dtype=np.int64)
+        renumber[keep] = np.arange(len(keep))
+
+        partitions = []
+        for partition in self.partitions:
+            vectors, rows = partition.view()
+            alive = ~deleted[rows]
+
+            compacted = _Rows(vectors.shape[1], max(64, int(alive.sum())))
+            compacted.size = int(alive.sum())
+            compacted.data[:compacted.size] = vectors[alive]
+            compacted.ids[:compacted.size] = renumber[rows[alive]]
+
+            partitions.append(compacted)
+
+        self.labels = [self.labels[row] for row in keep]
+        self.deleted = [False] * len(keep)
+        self.deleted_count = 0
+        self.rows = dict((employee_id, int(renumber[row])) for employee_id, row in self.rows.iteritems())
+        self.partitions = partitions
+
+    def update(self, employee_id, encoding):
+        """
+        Replace the encoding of an indexed employee
+        """
+        if employee_id in self.rows:
+            self.add(employee_id, self.labels[self.rows[employee_id]], encoding)
+
+    def search(self, embeddings):
+        """
+        :param embeddings: face encodings to look up
+        :return: employee no and distance of the nearest employee of each face, employee no is None if
+                 no employee is found
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, 128)
+
+        with self._lock:
+            centroids, partitions, labels, deleted = self.centroids, self.partitions, self.labels, self.deleted
+
+            if centroids is None:
+                probes = np.zeros((len(embeddings), 1), dtype=int)
+            else:
+                nprobe = min(self.nprobe, len(centroids))
+                probes = np.argsort(_sq_distances(embeddings, centroids), axis=1)[:, :nprobe]
+
+            results = []
+            for embedding, probe in zip(embeddings, probes):
+                best_no, best_d = None, np.inf
+
+                for p in probe:
+                    vectors, rows = partitions[p].view()
+                    if len(rows) == 0:
+                        continue
+
+                    d = _sq_distances(embedding[np.newaxis], vectors)[0]
+                    for i in np.argsort(d):
+                        if d[i] >= best_d:
+                            break
+
+                        if not deleted[rows[i]]:
+                            best_no, best_d = labels[rows[i]], d[i]
+                            break
+
+                results.append((best_no, float(np.sqrt(best_d))))
+
+        return results
+
+    def save(self, path):
+        """
+        Write a checkpoint of the index, the file is replaced atomically
+        :return: the version of the index written
+        """
+        created = time.time()
+
+        with self._lock:
+            version = self.version
+            max_employee_id = self.max_employee_id
+            centroids = self.centroids
+
+            encodings = np.empty((len(self.labels), 128), dtype=np.float32)
+            for partition in self.partitions:
+                vectors, rows = partition.view()
+                encodings[rows] = vectors
+
+            ids, rows = zip(*sorted(self.rows.iteritems(), key=lambda item: item[1])) if self.rows else ((), ())
+            labels = [self.labels[row] for row in rows]
+            encodings = encodings[list(rows)]
+
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            np.savez(f, ids=np.array(ids, dtype=np.int64), labels=np.array(labels), encodings=encodings,
+                     centroids=centroids if centroids is not None else np.empty((0, 128), dtype=np.float32),
+                     max_employee_id=np.int64(max_employee_id), created=np.float64(created))
+
+        os.rename(temp, path)
+
+        return version
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a checkpoint written by `save`, the partitions are kept
+        """
+        checkpoint = np.load(path)
+        try:
+            ids, labels, encodings, centroids = \
+                checkpoint['ids'].tolist(), checkpoint['labels'].tolist(), checkpoint['encodings'], \
+                checkpoint['centroids']
+            max_employee_id = int(checkpoint['max_employee_id'])
+            created = float(checkpoint['created'])
+        finally:
+            checkpoint.close()
+
+        index = cls()
+        index.build(ids, labels, encodings, centroids if len(centroids) > 0 else None)
+        index.max_employee_id = max(index.max_employee_id, max_employee_id)
+        index.created = created
+
+        return index
+
+
+class IndexMatcher(object):
+
+    def __init__(self, index, tolerance=0.6):
+        """
+        Match faces against all employees with the employee index
+        :param index: employee index
+        :type index: EmployeeIndex
+        :param tolerance: max distance between two faces to be a match
+        """
+        self.index = index
+        self.tolerance = tolerance
+
+    def __reduce__(self):
+        # a worker process uses its own copy of the module global index instead of a pickled one,
+        # loaded by its first job and reloaded from the checkpoints of the server process
+        return _global_index_matcher, (self.tolerance,)
+
+    def match(self, embeddings):
+        """
+        :param embeddings: face encodings of a frame
+        :return: a list of (employee_no, score) tuples, employee_no is '-1' for an unknown face
+        """
+        return [(no, 1 - d) if no is not None and d <= self.tolerance else ('-1', 0.0 if no is None else 1 - d)
+                for no, d in self.index.search(embeddings)]
+
+
+# index over all employees, built by `get_employee_index`
+employee_index = None
+_employee_index_lock = threading.Lock()
+
+# the index of this process is updated by enrolments and polls, the other processes reload its checkpoints
+_owner = False
+_saved_version = None
+
+# largest employee id loaded from the database, see `centroid._polled_id`
+_polled_id = 0
+_checkpoint_mtime = None
+_checked = 0
+
+
+def _load_index():
+    global _polled_id
+
+    import snapshot
+    from db import storage
+
+    changed = added = [], [], []
+
+    if index_checkpoint and os.path.exists(index_checkpoint):
+        index = EmployeeIndex.load(index_checkpoint)
+        print('Loaded employee index of {} employees from "{}"'.format(len(index), index_checkpoint))
+
+        changed = snapshot.load_changes(storage, index.created, index.max_employee_id)
+        added = storage.load_all_employee_reps(index.max_employee_id)
+    else:
+        index = EmployeeIndex()
+
+        if snapshot.current is None:
+            index.build(*storage.load_all_employee_reps())
+        else:
+            index.build(*snapshot.current.employee_reps())
+            changed, added = snapshot.current.delta_reps(storage)
+
+    # encodings changed after the checkpoint or the snapshot
+    for employee_id, _, encoding in zip(*changed):
+        index.update(employee_id, encoding)
+
+    # encodings added after the checkpoint or the snapshot
+    for employee_id, employee_no, encoding in zip(*added):
+        if employee_id not in index:
+            index.add(employee_id, employee_no, encoding)
+
+    _polled_id = index.max_employee_id
+
+    return index
+
+
+def get_employee_index():
+    global employee_index, _checkpoint_mtime
+
+    if not _owner and employee_index is not None:
+        _reload()
+
+    with _employee_index_lock:
+        if employee_index is None:
+            if index_checkpoint and os.path.exists(index_checkpoint):
+                _checkpoint_mtime = os.path.getmtime(index_checkpoint)
+
+            employee_index = _load_index()
+
+    return employee_index
+
+
+def _reload():
+    """
+    Swap in the last checkpoint if it changed, checked every `index_reload_interval` seconds
+    """
+    global employee_index, _checkpoint_mtime, _checked
+
+    now = time.time()
+    if not index_checkpoint or now - _checked < index_reload_interval:
+        return
+
+    _checked = now
+
+    try:
+        mtime = os.path.getmtime(index_checkpoint)
+    except OSError:
+        return
+
+    if mtime != _checkpoint_mtime:
+        _checkpoint_mtime = mtime
+        employee_index = EmployeeIndex.load(index_checkpoint)
+
+
+def init_worker():
+    """
+    Initializer of the recognition processes: drop the connections inherited from the parent. The index is
+    loaded by the first job which needs it, unless the parent built it before forking
+    """
+    from db import storage
+
+    storage.dispose()
+
+
+def _global_index_matcher(tolerance):
+    return IndexMatcher(get_employee_index(), tolerance)
+
+
+def add_employee(employee_id, employee_no, encoding):
+    """
+    Insert a new or changed encoding into the employee index if it is built
+    :param employee_no: employee no, None to keep the employee no of an indexed employee
+    """
+    if employee_index is None:
+        return
+
+    if employee_no is None:
+        employee_index.update(employee_id, encoding)
+    else:
+        employee_index.add(employee_id, employee_no, encoding)
+
+
+def checkpoint():
+    """
+    Write a checkpoint if the index changed since the last one, it's blocking
+    """
+    global _saved_version
+
+    index = employee_index
+    if index is None or not index_checkpoint or index.version == _saved_version:
+        return
+
+    _saved_version = index.save(index_checkpoint)
+    print('Wrote employee index checkpoint "{}" of {} employees'.format(index_checkpoint, len(index)))
+
+
+def poll():
+    """
+    Insert the employees added by other server processes, off the reactor thread
+    """
+    from db import async_storage
+
+    index = employee_index
+    if index is None:
+        return
+
+    def absorb(reps):
+        global _polled_id
+
+        for employee_id, employee_no, encoding in zip(*reps):
+            _polled_id = max(_polled_id, employee_id)
+
+            # already added by an enrolment on this process
+            if employee_id not in index:
+                index.add(employee_id, employee_no, encoding)
+
+    def failed(failure):
+        print('Fail to poll new encodings: {}'.format(failure.getErrorMessage()))
+
+    return async_storage.load_all_employee_reps(_polled_id).addCallbacks(absorb, failed)
+
+
+def start(checkpoint_interval=index_checkpoint_interval, poll_interval=index_poll_interval):
+    """
+    Own the index in this server process, once it is built: write checkpoints every `checkpoint_interval`
+    seconds and poll the employees added by other server processes every `poll_interval` seconds. 0 disables
+    them. Worker processes forked before never own the index, they reload its checkpoints.
+    """
+    global _owner
+
+    from twisted.internet import task, threads
+
+    _owner = True
+
+    def failed(failure):
+        print('Fail to write the employee index checkpoint: {}'.format(failure.getErrorMessage()))
+
+    def write():
+        return threads.deferToThread(checkpoint).addErrback(failed)
+
+    if checkpoint_interval > 0 and index_checkpoint:
+        task.LoopingCall(write).start(checkpoint_interval, now=False)
+
+    if poll_interval > 0:
+        task.LoopingCall(poll).start(poll_interval, now=False)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import time
+import numpy as np
+import conf
+
+attendance_window = int(conf.get_prop('attendance', 'window', '10'))
+attendance_arrive_count = int(conf.get_prop('attendance', 'arrive_count', '3'))
+attendance_leave_count = int(conf.get_prop('attendance', 'leave_count', '0'))
+
+
+class Presence(object):
+
+    __slots__ = ('id', 'no', 'name', 'english_name', 'is_attendant', 'scores', 'present',
+                 'first_seen', 'last_seen', 'detections', 'score_sum', 'arrivals')
+
+    def __init__(self, face, window):
+        self.id = face['id']
+        self.no = face['no']
+        self.name = face['name']
+        self.english_name = face.get('english_name')
+        self.is_attendant = face['is_attendant']
+
+        # score of the employee in each frame of the window, NaN if not detected
+        self.scores = np.full(window, np.nan, dtype=np.float32)
+        self.present = False
+
+        # totals over the whole session
+        self.first_seen = None
+        self.last_seen = None
+        self.detections = 0
+        self.score_sum = 0.0
+        self.arrivals = 0
+
+    def hits(self):
+        return int(np.count_nonzero(~np.isnan(self.scores)))
+
+    def confidence(self):
+        """
+        :return: mean score of the detections in the window
+        """
+        hits = self.hits()
+        return float(np.nansum(self.scores)) / hits if hits > 0 else 0.0
+
+    def change(self, state, now):
+        return {
+            'id': self.id,
+            'no': self.no,
+            'name': self.name,
+            'english_name': self.english_name,
+            'is_attendant': self.is_attendant,
+            'state': state,
+            'confidence': self.confidence(),
+            'last_seen': self.last_seen,
+            'time': now
+        }
+
+
+class Attendance(object):
+
+    def __init__(self, attendants, window=attendance_window, arrive_count=attendance_arrive_count,
+                 leave_count=attendance_leave_count):
+        """
+        Attendance of a session smoothed over the last `window` frames, so that a single misclassified
+        frame doesn't flip it. Each employee seen has a ring buffer of its scores in the window, shared
+        slot for slot with the other employees. An employee arrives once detected in `arrive_count`
+        frames of the window, and leaves once detected in `leave_count` frames or less.
+        :param attendants: ids of the participants of the meeting
+        """
+        assert 0 <= leave_count < arrive_count <= window
+
+        self.attendants = attendants
+        self.window = window
+        self.arrive_count = arrive_count
+        self.leave_count = leave_count
+
+        # number of frames observed
+        self.frames = 0
+        self.started = time.time()
+
+        # employee no -> Presence, of every employee seen in the session
+        self.employees = {}
+
+        # employees with detections in the window, only their ring buffers are updated
+        self._active = {}
+
+    def observe(self, faces, now=None):
+        """
+        Add the faces of a frame to the window
+        :param faces: faces of the PROCESSED reply of the frame, unknown faces are ignored
+        :return: list of the attendance changes, arrived or left, caused by the frame
+        """
+        if now is None:
+            now = time.time()
+
+        slot = self.frames % self.window
+        self.frames += 1
+
+        # the slot leaves the window
+        for p in self._active.itervalues():
+            p.scores[slot] = np.nan
+
+        for face in faces:
+            if face['id'] == -1:
+                continue
+
+            p = self.employees.get(face['no'])
+            if p is None:
+                p = self.employees[face['no']] = Presence(face, self.window)
+
+            self._active[p.no] = p
+
+            score = face['score']
+            if np.isnan(p.scores[slot]) or score > p.scores[slot]:
+                if np.isnan(p.scores[slot]):
+                    p.detections += 1
+                    p.score_sum += score
+                else:
+                    # the best of several faces recognized as the same employee
+                    p.score_sum += score - p.scores[slot]
+
+                p.scores[slot] = score
+
+            if p.first_seen is None:
+                p.first_seen = now
+            p.last_seen = now
+
+        changes = []
+
+        for no, p in self._active.items():
+            hits = p.hits()
+
+            if not p.present and hits >= self.arrive_count:
+                p.present = True
+                p.arrivals += 1
+                changes.append(p.change('arrived', now))
+            elif p.present and hits <= self.leave_count:
+                p.present = False
+                changes.append(p.change('left', now))
+
+            if hits == 0:
+                del self._active[no]
+
+        return changes
+
+    def present(self):
+        """
+        :return: employee nos of the employees present
+        """
+        return [no for no, p in self.employees.iteritems() if p.present]
+
+    def summary(self):
+        """
+        :return: attendance of the whole session, sent with CLOSED
+        """
+        seen = set(p.id for p in self.employees.itervalues() if p.arrivals > 0)
+
+        return {
+            'frames': self.frames,
+            'started': self.started,
+            'employees': [{
+                'id': p.id,
+                'no': p.no,
+                'name': p.name,
+                'english_name': p.english_name,
+                'is_attendant': p.is_attendant,
+                'present': p.present,
+                'first_seen': p.first_seen,
+                'last_seen': p.last_seen,
+                'detections': p.detections,
+                'arrivals': p.arrivals,
+                'confidence': p.score_sum / p.detections if p.detections > 0 else 0.0
+            } for p in sorted(self.employees.itervalues(), key=lambda p: p.first_seen) if p.arrivals > 0],
+            'absent_attendants': [a for a in self.attendants if a not in seen]
+        }
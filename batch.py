@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+"""
+Offline faces recognition of a video file or a directory of images, without the WebSocket server.
+Frames are read and recognized on a process pool, results are written in frame order as JSON lines:
+
+    python batch.py recording.mp4 --output recording.jsonl --step 5
+    python batch.py ./photos --match attendants --meeting-id 42
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+import time
+import click
+import cv2
+
+from imgdecode import decoder
+from recognition import recognize_images
+from tracker import FaceTracker, tracker_enabled, tracker_refresh_interval
+
+image_exts = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# matcher of the faces of this process, None for the classifier. Set by `init_worker` on each pool process
+_matcher = None
+
+
+def list_images(directory):
+    """
+    :return: the names of the images of a directory, sorted
+    """
+    return sorted(name for name in os.listdir(directory) if os.path.splitext(name)[1].lower() in image_exts)
+
+
+def check_source(source):
+    """
+    Fail early on a source without frames, jobs are produced inside the pool which would swallow the error
+    :raise click.BadParameter: if the source is not a readable video or a directory of images
+    """
+    if os.path.isdir(source):
+        if not list_images(source):
+            raise click.BadParameter('No image in directory {}'.format(source))
+        return
+
+    capture = cv2.VideoCapture(source)
+    try:
+        if not capture.isOpened():
+            raise click.BadParameter('Can\'t open video {}'.format(source))
+    finally:
+        capture.release()
+
+
+def iter_jobs(source, step=1, segment=250, images_per_job=8):
+    """
+    Split a source into jobs, every job reads its own frames so that no frame is sent to the workers
+    :param source: video file or directory of images, checked by `check_source`
+    :param step: recognize one frame out of `step`
+    :param segment: number of video frames of a job
+    :param images_per_job: number of images of a job
+    :return: a generator of jobs
+    """
+    if os.path.isdir(source):
+        names = list_images(source)
+        paths = [(i, os.path.join(source, name)) for i, name in enumerate(names)][::step]
+
+        for i in range(0, len(paths), images_per_job):
+            yield 'images', paths[i:i + images_per_job]
+        return
+
+    capture = cv2.VideoCapture(source)
+    count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    capture.release()
+
+    if count <= 0:
+        # unknown length, read the whole video in one job
+        yield 'video', source, fps, 0, None, step
+        return
+
+    # segments start on a frame that is recognized
+    segment = max(step, segment - segment % step)
+
+    for start in range(0, count, segment):
+        # the last segment reads until the end, the frame count of a video is an estimate
+        yield 'video', source, fps, start, segment if start + segment < count else None, step
+
+
+def run_job(job):
+    """
+    Recognize the frames of a job, it runs on the pool processes
+    :return: a list of (frame index, source, seconds in the video or None, faces) tuples,
+             faces are (face_location, employee_no, score) tuples
+    """
+    if job[0] == 'images':
+        return recognize_image_files(job[1])
+
+    return recognize_video_segment(*job[1:])
+
+
+def recognize_image_files(paths):
+    imgs = []
+    indices = []
+
+    for index, path in paths:
+        try:
+            with open(path, 'rb') as f:
+                imgs.append(decoder.decode(f.read()))
+            indices.append((index, path))
+        except IOError as e:
+            print >> sys.stderr, 'Skip {}: {}'.format(path, e)
+
+    results = recognize_images(imgs, matchers=[_matcher] * len(imgs))
+
+    return [(index, path, None, [(location, employee_no, score) for location, employee_no, score, _ in faces])
+            for (index, path), faces in zip(indices, results)]
+
+
+def recognize_video_segment(path, fps, start, count, step):
+    """
+    Frames of a segment are recognized one after the other, faces are tracked across the frames
+    """
+    capture = cv2.VideoCapture(path)
+    if start > 0:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    tracker = FaceTracker(refresh_interval=tracker_refresh_interval if tracker_enabled else 0)
+    results = []
+    img = None
+
+    try:
+        index = start
+        while count is None or index < start + count:
+            if (index - start) % step != 0:
+                # skipped frames are not decoded
+                if not capture.grab():
+                    break
+                index += 1
+                continue
+
+            ok, frame = capture.read()
+            if not ok:
+                break
+
+            img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=img if img is not None and img.shape == frame.shape
+                               else None)
+
+            faces = recognize_images([img], [tracker.reusable_locations()], [_matcher])[0]
+            results.append((index, path, index / fps, tracker.update(faces)))
+
+            index += 1
+    finally:
+        capture.release()
+
+    return results
+
+
+def load_matcher(match, meeting_id, tolerance):
+    """
+    :return: the matcher of a match mode, see `server.load_session`
+    """
+    if match == 'classifier':
+        return None
+
+    if match == 'attendants':
+        from db import storage
+        from matcher import AttendantMatcher
+
+        _, nos, _, reps = storage.load_attendants(meeting_id)
+        return AttendantMatcher(nos, reps, tolerance)
+
+    from ann import IndexMatcher, get_employee_index
+
+    return IndexMatcher(get_employee_index(), tolerance)
+
+
+def init_worker(match, meeting_id, tolerance):
+    """
+    Initializer of the pool processes: load the matcher in each process, the global of the parent isn't
+    inherited when processes are spawned (e.g. on Windows)
+    """
+    global _matcher
+
+    from db import storage
+
+    # connections inherited from the parent must not be shared
+    storage.dispose()
+
+    _matcher = load_matcher(match, meeting_id, tolerance)
+
+
+def iter_records(results, employees=None, attendants=None):
+    """
+    :param results: results of the jobs, in frame order
+    :param employees: employees by employee no, to add the names
+    :param attendants: ids of the meeting attendants
+    :return: a generator of the json record of each frame
+    """
+    for frames in results:
+        for index, source, seconds, faces in frames:
+            record = {'frame': index, 'source': source, 'faces': []}
+            if seconds is not None:
+                record['time'] = round(seconds, 3)
+
+            for face_location, employee_no, score in faces:
+                face = {'no': employee_no, 'score': float(score), 'face_location': list(face_location)}
+
+                e = employees.get(employee_no) if employees is not None else None
+                if e is not None:
+                    face['name'] = e['fullname']
+                    face['english_name'] = e['english_name']
+
+                    if attendants is not None:
+                        face['is_attendant'] = e['id'] in attendants
+
+                record['faces'].append(face)
+
+            yield record
+
+
+@click.command()
+@click.argument('source')
+@click.option('--output', default='-', help='JSON lines file of the results. Default is the standard output')
+@click.option('--workers', default=0, help='Number of recognition processes. Default is 0 (number of cores)')
+@click.option('--step', default=1, help='Recognize one frame out of step. Default is 1')
+@click.option('--segment', default=250, help='Number of video frames of a job. Default is 250')
+@click.option('--match', type=click.Choice(['classifier', 'attendants', 'index']), default='classifier',
+              help='How faces are recognized, see the OPEN message of the server. Default is \'classifier\'')
+@click.option('--meeting-id', default=None, type=int,
+              help='Meeting of the attendants, required by --match attendants and to flag the attendants')
+@click.option('--tolerance', default=0.6, help='Max distance of a match of the \'attendants\' and \'index\' modes')
+@click.option('--names/--no-names', default=False, help='Add employee names, they are loaded from the database')
+def main(source, output, workers, step, segment, match, meeting_id, tolerance, names):
+    if match == 'attendants' and meeting_id is None:
+        raise click.BadParameter('--match attendants requires --meeting-id')
+
+    check_source(source)
+
+    employees = None
+    attendants = None
+    if names or meeting_id is not None:
+        from db import storage
+
+        employees = storage.load_all_employees()
+        if meeting_id is not None:
+            attendants = set(storage.load_attendants_by_meeting_id(meeting_id))
+
+    # the models are loaded on import, the matcher by each pool process
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count(), initializer=init_worker,
+                                initargs=(match, meeting_id, tolerance))
+    out = sys.stdout if output == '-' else open(output, 'w')
+
+    start = time.time()
+    frames = 0
+
+    try:
+        # imap keeps the order of the jobs, and only reads ahead of the slowest job as far as the pool does
+        for record in iter_records(pool.imap(run_job, iter_jobs(source, step, segment)), employees, attendants):
+            out.write(json.dumps(record) + '\n')
+            frames += 1
+    finally:
+        pool.terminate()
+
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.time() - start
+    print >> sys.stderr, 'Recognized {} frames in {:.1f}s, {:.2f} fps'.format(
+        frames, elapsed, frames / elapsed if elapsed > 0 else float('nan'))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
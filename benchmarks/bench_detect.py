@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare recall and latency of full resolution and downscaled face detection, against labelled faces.
+
+The reference image set is the validation set of WIDER FACE (http://shuoyang1213.me/WIDERFACE/): download
+WIDER_val.zip and wider_face_split.zip, then run from the project directory so that conf.ini is found:
+
+    python benchmarks/bench_detect.py --images WIDER_val/images \\
+        --annotations wider_face_split/wider_face_val_bbx_gt.txt --limit 200 --scale 0.5 --upsample 1
+
+The first `--limit` images in name order are used, and labelled faces smaller than `--min-face` pixels are
+ignored (the HOG detector can't find them at any setting), so the numbers are reproducible. Without
+--annotations, the faces found by the full resolution mode are the reference.
+"""
+
+import os
+import sys
+import time
+import click
+import numpy as np
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face import api
+from tracker import box_iou
+
+image_exts = ('.jpg', '.jpeg', '.png')
+
+
+def read_wider_annotations(path):
+    """
+    :param path: annotation file in the WIDER FACE format: the image path, the number of faces, then one
+                 'x y w h blur expression illumination invalid occlusion pose' line per face
+    :return: labelled face locations in css (left, top, right, bottom) order by image path
+    """
+    annotations = {}
+
+    with open(path) as f:
+        lines = iter(line.strip() for line in f)
+
+        for name in lines:
+            if not name:
+                continue
+
+            count = int(next(lines))
+            faces = []
+
+            # an image without face still has one line of zeros
+            for _ in range(max(count, 1)):
+                values = [int(v) for v in next(lines).split()]
+                x, y, w, h = values[:4]
+                invalid = values[7] if len(values) > 7 else 0
+
+                if count > 0 and not invalid:
+                    faces.append((x, y, x + w, y + h))
+
+            annotations[name] = faces
+
+    return annotations
+
+
+def load_images(images_dir, annotations=None, limit=0, min_face=0):
+    """
+    :return: (name, RGB image, labelled faces or None) of the images in name order
+    """
+    if annotations is not None:
+        names = sorted(name for name in annotations if os.path.exists(os.path.join(images_dir, name)))
+    else:
+        names = sorted(name for name in os.listdir(images_dir) if os.path.splitext(name)[1].lower() in image_exts)
+
+    if limit > 0:
+        names = names[:limit]
+
+    imgs = []
+    for name in names:
+        img = np.asarray(Image.open(os.path.join(images_dir, name)).convert('RGB')).copy()
+
+        labels = None
+        if annotations is not None:
+            labels = [face for face in annotations[name] if min(face[2] - face[0], face[3] - face[1]) >= min_face]
+
+        imgs.append((name, img, labels))
+
+    return imgs
+
+
+def run(imgs, upsample, scale, repeat):
+    """
+    :return: detected locations of each image, latencies in milliseconds
+    """
+    locations = []
+    latencies = []
+
+    for _, img, _ in imgs:
+        for _ in range(repeat):
+            start = time.time()
+            faces = api.detect_faces(img, upsample, scale)
+            latencies.append((time.time() - start) * 1000)
+
+        locations.append(faces)
+
+    return locations, np.array(latencies)
+
+
+def recall(reference, candidate, min_iou=0.5):
+    """
+    Fraction of faces of the reference found by the candidate detection
+    """
+    total = 0
+    found = 0
+
+    for ref_faces, faces in zip(reference, candidate):
+        total += len(ref_faces)
+        found += sum(1 for ref in ref_faces if any(box_iou(ref, face) >= min_iou for face in faces))
+
+    return float(found) / total if total > 0 else 1.0
+
+
+def precision(reference, candidate, min_iou=0.5):
+    """
+    Fraction of faces of the candidate detection matching a reference face
+    """
+    return recall(candidate, reference, min_iou)
+
+
+@click.command()
+@click.option('--images', required=True, help='Directory of the images, e.g. WIDER_val/images')
+@click.option('--annotations', default=None,
+              help='Labelled faces in the WIDER FACE format, e.g. wider_face_val_bbx_gt.txt. '
+                   'Default compares with the full resolution mode')
+@click.option('--limit', default=200, help='Number of images, in name order, 0 for all. Default is 200')
+@click.option('--min-face', default=40, help='Min size in pixels of the labelled faces counted. Default is 40')
+@click.option('--min-iou', default=0.5, help='Min IoU of a detected and a labelled face to match. Default is 0.5')
+@click.option('--scale', default=0.5, help='Scale of the downscaled mode. Default is 0.5')
+@click.option('--upsample', default=1, help='Upsample count of the downscaled mode. Default is 1')
+@click.option('--repeat', default=3, help='Number of runs for each image. Default is 3')
+def main(images, annotations, limit, min_face, min_iou, scale, upsample, repeat):
+    labelled = read_wider_annotations(annotations) if annotations is not None else None
+    imgs = load_images(images, labelled, limit, min_face)
+    print('Loaded {} images from {}'.format(len(imgs), images))
+
+    full, full_latencies = run(imgs, None, 1.0, repeat)
+    fast, fast_latencies = run(imgs, upsample, scale, repeat)
+
+    reference = [labels for _, _, labels in imgs] if labelled is not None else full
+    print('Reference: {} faces {}'.format(sum(len(faces) for faces in reference),
+                                          'labelled' if labelled is not None else 'found by the full mode'))
+
+    print('{:<28} {:>8} {:>10} {:>10} {:>8} {:>10}'.format(
+        'mode', 'faces', 'mean(ms)', 'p95(ms)', 'recall', 'precision'))
+    for name, locations, latencies in [
+            ('full', full, full_latencies),
+            ('downscale {} upsample={}'.format(scale, upsample), fast, fast_latencies)]:
+        print('{:<28} {:>8} {:>10.2f} {:>10.2f} {:>8.3f} {:>10.3f}'.format(
+            name, sum(len(l) for l in locations), latencies.mean(), np.percentile(latencies, 95),
+            recall(reference, locations, min_iou), precision(reference, locations, min_iou)))
+
+
+if __name__ == '__main__':
+    main()
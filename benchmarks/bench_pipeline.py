@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the recognition pipeline end to end. Simulated WebSocket sessions send frames through
+`FaceServerProtocol` one after the other, the next frame is sent when the reply of the previous one is
+received. Meetings and employees are seeded in a temporary database of the SQLite storage backend.
+
+Per-stage latencies (decode, detect, landmarks, descriptor, predict_proba, ...), frame latency and
+throughput are measured at each number of concurrent sessions and written as JSON, so that runs with
+different dlib versions, configurations or patches can be compared.
+
+Run it from the project directory, models are loaded from the paths of conf.ini (or --conf):
+
+    python benchmarks/bench_pipeline.py --images ./samples --sessions 1,4,16 --output results.json
+
+Without --images, synthetic frames are used: they contain no faces, so only decode and detect are measured.
+"""
+
+import ConfigParser
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import click
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+from bench_decode import load_frames
+
+
+def write_conf(base, path, db_path):
+    """
+    Copy the configuration, with the database replaced by SQLite, the background polls and the result cache
+    disabled (the samples are replayed, they would be served by the cache)
+    """
+    parser = ConfigParser.ConfigParser()
+    parser.read(base)
+
+    for section in ('db', 'snapshot', 'directory', 'cache'):
+        if not parser.has_section(section):
+            parser.add_section(section)
+
+    parser.set('db', 'backend', 'sqlite')
+    parser.set('db', 'sqlite_path', db_path)
+    parser.set('snapshot', 'path', '')
+    parser.set('directory', 'poll_interval', '0')
+    parser.set('directory', 'full_reload_interval', '0')
+    parser.set('cache', 'enabled', 'false')
+
+    with open(path, 'w') as f:
+        parser.write(f)
+
+
+def seed(storage, employees, attendants, random_seed):
+    """
+    Create the tables and a meeting of `attendants` of `employees` employees with random face encodings
+    :return: the meeting id
+    """
+    from db import Employee, EmployeeReps, MeetingSchedule, encode_reps
+
+    rng = np.random.RandomState(random_seed)
+
+    sess = storage.Session()
+    try:
+        rows = [Employee(no='B{:06d}'.format(i), firstname='First{}'.format(i), lastname='Last{}'.format(i),
+                         engname='Employee{}'.format(i), title='Engineer', group='Bench', gender=i % 2,
+                         email='employee{}@example.com'.format(i)) for i in range(employees)]
+        sess.add_all(rows)
+        sess.flush()
+
+        encodings = rng.normal(0, 1 / np.sqrt(128), (employees, 128)).astype(np.float32)
+        sess.add_all([EmployeeReps(employee_id=e.id, face_reps=encode_reps(encoding))
+                      for e, encoding in zip(rows, encodings)])
+
+        meeting = MeetingSchedule(s_attendant_id=','.join(str(e.id) for e in rows[:attendants]))
+        sess.add(meeting)
+        sess.commit()
+
+        return meeting.s_id
+    finally:
+        sess.close()
+
+
+def stats(values):
+    """
+    :param values: durations in seconds
+    :return: summary in milliseconds
+    """
+    if len(values) == 0:
+        return {'count': 0}
+
+    values = np.array(values) * 1000
+
+    return {
+        'count': len(values),
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max())
+    }
+
+
+def versions():
+    found = {'python': platform.python_version(), 'numpy': np.__version__}
+
+    for name in ('dlib', 'cv2', 'sklearn', 'twisted', 'autobahn', 'sqlalchemy', 'PIL'):
+        try:
+            found[name] = getattr(__import__(name), '__version__', None)
+        except ImportError:
+            found[name] = None
+
+    return found
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=root_dir).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option('--images', default=None, help='Directory of sample JPEG frames. Default is a synthetic frame')
+@click.option('--width', default=1280, help='Width of the synthetic frame. Default is 1280')
+@click.option('--height', default=720, help='Height of the synthetic frame. Default is 720')
+@click.option('--sessions', default='1,4,16', help='Numbers of concurrent sessions to run. Default is 1,4,16')
+@click.option('--frames', default=50, help='Frames sent by each session. Default is 50')
+@click.option('--warmup', default=5, help='Frames sent by one session before measuring. Default is 5')
+@click.option('--match', type=click.Choice(['classifier', 'attendants', 'index']), default='classifier',
+              help='How sessions recognize faces. Default is \'classifier\'')
+@click.option('--transport', type=click.Choice(['binary', 'data_url']), default='binary',
+              help='Send frames as binary messages or as data_url in json messages. Default is \'binary\'')
+@click.option('--employees', default=1000, help='Number of employees seeded in the database. Default is 1000')
+@click.option('--attendants', default=20, help='Number of attendants of the meeting. Default is 20')
+@click.option('--pool-type', type=click.Choice(['thread', 'process']), default='thread',
+              help='Run faces recognition on worker threads or processes. Default is \'thread\'')
+@click.option('--pool-size', default=4, help='Number of recognition workers. Default is 4')
+@click.option('--pool-queue', default=16, help='Max number of jobs waiting for a free worker. Default is 16')
+@click.option('--batch-window', default=0, help='Milliseconds to gather frames into one batch. Default is 0')
+@click.option('--batch-size', default=16, help='Max number of frames in a batch. Default is 16')
+@click.option('--conf', default=os.path.join(root_dir, 'conf.ini'), help='Configuration the models are read from')
+@click.option('--seed', 'random_seed', default=0, help='Seed of the random face encodings. Default is 0')
+@click.option('--output', default='bench_pipeline.json', help='JSON results file. Default is bench_pipeline.json')
+def main(images, width, height, sessions, frames, warmup, match, transport, employees, attendants, pool_type,
+         pool_size, pool_queue, batch_window, batch_size, conf, random_seed, output):
+    levels = [int(n) for n in sessions.split(',')]
+    samples = load_frames(images, width, height)
+
+    temp_dir = tempfile.mkdtemp(prefix='facego-bench-')
+    try:
+        # the modules of the server read the configuration when they are imported
+        conf_path = os.path.join(temp_dir, 'conf.ini')
+        write_conf(conf, conf_path, os.path.join(temp_dir, 'bench.db'))
+        os.environ['FACEGO_CONF'] = conf_path
+
+        results = run(samples, levels, frames, warmup, match, transport, employees, attendants, pool_type,
+                      pool_size, pool_queue, batch_window, batch_size, random_seed)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': git_revision(),
+        'platform': platform.platform(),
+        'cpus': multiprocessing.cpu_count(),
+        'versions': versions(),
+        'config': {
+            'images': images, 'frames': len(samples), 'frame_bytes': sum(len(f) for f in samples) // len(samples),
+            'frames_per_session': frames, 'match': match, 'transport': transport, 'employees': employees,
+            'attendants': attendants, 'pool_type': pool_type, 'pool_size': pool_size, 'pool_queue': pool_queue,
+            'batch_window': batch_window, 'batch_size': batch_size, 'seed': random_seed
+        },
+        'results': results
+    }
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print('{:>8} {:>8} {:>10} {:>10} {:>10} {:>6}'.format('sessions', 'frames', 'fps', 'mean(ms)', 'p95(ms)', 'busy'))
+    for r in results:
+        print('{:>8} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>6}'.format(
+            r['sessions'], r['frames'], r['fps'], r['latency'].get('mean', 0), r['latency'].get('p95', 0), r['busy']))
+    print('Wrote {}'.format(output))
+
+
+def run(samples, levels, frames, warmup, match, transport, employees, attendants, pool_type, pool_size,
+        pool_queue, batch_window, batch_size, random_seed):
+    """
+    Run the simulated sessions of every level on a reactor
+    :return: results of each level
+    """
+    import metrics
+
+    from twisted.internet import defer, reactor
+    from autobahn.twisted.websocket import WebSocketServerProtocol
+
+    from db import storage
+    from directory import employee_directory
+    from imgdecode import data_url_head
+    from recognition import recognize_batch
+    from server import BINARY_PROCESSING, FaceServerFactory, FaceServerProtocol, binary_header
+    from worker import Batcher, WorkerPool, WorkerPoolBusy
+
+    class Recorder(metrics.Histogram):
+        """
+        Stage histogram keeping every sample, for exact percentiles
+        """
+
+        def __init__(self):
+            metrics.Histogram.__init__(self, 'facego_stage_seconds', 'Stages', label='stage')
+            self.values = {}
+
+        def observe(self, value, label_value=None):
+            metrics.Histogram.observe(self, value, label_value)
+            self.values.setdefault(label_value, []).append(value)
+
+    class SimulatedClient(FaceServerProtocol):
+        """
+        A session sending frames one after the other, replies are read from `sendMessage`
+        """
+
+        def __init__(self, index, count):
+            FaceServerProtocol.__init__(self)
+            self.state = WebSocketServerProtocol.STATE_OPEN
+
+            self.index = index
+            self.count = count
+            self.sent = 0
+            self.busy = 0
+            self.failed = 0
+
+            self.sess_id = None
+            self.sent_at = None
+            self.first_sent = None
+            self.last_replied = None
+            self.latencies = []
+
+            self.done = defer.Deferred()
+
+        def open(self, meeting_id):
+            self.onMessage(json.dumps({'type': 'OPEN', 'meeting_id': meeting_id, 'match': match}), False)
+
+        def sendMessage(self, payload, isBinary=False, *args, **kwargs):
+            # reply on the next reactor iteration, like a real round trip
+            reactor.callLater(0, self.replied, json.loads(payload))
+
+        def replied(self, msg):
+            if msg['type'] == 'OPENED':
+                self.sess_id = msg['session_id']
+                self.send()
+            elif msg['type'] == 'OPEN_FAILED':
+                self.done.errback(Exception(msg['message']))
+            elif msg['type'] == 'BUSY':
+                self.busy += 1
+                reactor.callLater(0.01, self.send, False)
+            elif msg['type'] == 'PROCESSED':
+                self.last_replied = time.time()
+                self.latencies.append(self.last_replied - self.sent_at)
+                self.send()
+
+        def frame_failed(self, failure, sess_id):
+            FaceServerProtocol.frame_failed(self, failure, sess_id)
+
+            # there is no reply to wait for
+            if not failure.check(WorkerPoolBusy):
+                self.failed += 1
+                reactor.callLater(0, self.send)
+
+        def send(self, advance=True):
+            if advance and self.sent == self.count:
+                self.done.callback(self)
+                return
+
+            if advance:
+                self.sent += 1
+
+            frame = samples[(self.index + self.sent) % len(samples)]
+
+            self.sent_at = time.time()
+            if self.first_sent is None:
+                self.first_sent = self.sent_at
+
+            if transport == 'binary':
+                self.onMessage(binary_header.pack(BINARY_PROCESSING, uuid.UUID(self.sess_id).bytes) + frame, True)
+            else:
+                self.onMessage(json.dumps({
+                    'type': 'PROCESSING',
+                    'session_id': self.sess_id,
+                    'data_url': data_url_head + frame.encode('base64').replace('\n', '')
+                }), False)
+
+    meeting_id = seed(storage, employees, attendants, random_seed)
+    employee_directory.load()
+
+    pool = WorkerPool(pool_type, pool_size, pool_queue)
+    pool.start(reactor)
+
+    factory = FaceServerFactory()
+    factory.pool = pool
+    factory.batcher = Batcher(pool, recognize_batch, batch_window / 1000.0, batch_size)
+
+    results = []
+
+    def level(n, count, record=True):
+        metrics.stage_seconds = recorder = Recorder()
+
+        clients = [SimulatedClient(i, count) for i in range(n)]
+        for client in clients:
+            client.factory = factory
+            client.open(meeting_id)
+
+        def summarize(_):
+            if not record:
+                return
+
+            latencies = sum((c.latencies for c in clients), [])
+            replied = [c.last_replied for c in clients if c.last_replied is not None]
+            elapsed = max(replied) - min(c.first_sent for c in clients) if replied else 0.0
+
+            results.append({
+                'sessions': n,
+                'frames': len(latencies),
+                'seconds': elapsed,
+                'fps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+                'busy': sum(c.busy for c in clients),
+                'failed': sum(c.failed for c in clients),
+                'latency': stats(latencies),
+                'stages': dict((name, stats(values)) for name, values in recorder.values.iteritems())
+            })
+            sys.__stdout__.write('{} sessions: {:.2f} fps\n'.format(n, results[-1]['fps']))
+
+        return defer.gatherResults([c.done for c in clients], consumeErrors=True).addCallback(summarize)
+
+    @defer.inlineCallbacks
+    def run_levels():
+        # silence the per frame logs of the server
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            if warmup > 0:
+                yield level(1, warmup, record=False)
+
+            for n in levels:
+                yield level(n, frames)
+        finally:
+            sys.stdout = stdout
+            reactor.stop()
+
+    failures = []
+    reactor.callWhenRunning(lambda: run_levels().addErrback(failures.append))
+    reactor.run()
+
+    if failures:
+        failures[0].raiseException()
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
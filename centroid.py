@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+import numpy as np
+import conf
+
+centroid_tolerance = float(conf.get_prop('classifier', 'centroid_tolerance', '0.6'))
+centroid_checkpoint = conf.get_prop('classifier', 'centroid_checkpoint', 'centroid.npz')
+centroid_checkpoint_interval = float(conf.get_prop('classifier', 'checkpoint_interval', '60'))
+centroid_poll_interval = float(conf.get_prop('classifier', 'poll_interval', '30'))
+centroid_reload_interval = float(conf.get_prop('classifier', 'reload_interval', '5'))
+
+
+class CentroidModel(object):
+
+    def __init__(self, tolerance=centroid_tolerance, dim=128, capacity=64):
+        """
+        Nearest class centroid classifier over the face encodings of all employees, one class for each employee.
+        It is updated online: a new or changed encoding is absorbed in O(dim), without retraining.
+        Readers use the state published by the last update, an update never blocks them: appended rows are
+        beyond the size of the published state, and a changed row is written to copies of the arrays.
+        :param tolerance: max distance between a face and a centroid to be a match
+        :param dim: dimension of the encodings
+        :param capacity: initial number of rows, grown by doubling
+        """
+        self.tolerance = tolerance
+        self.dim = dim
+
+        # largest employee id absorbed, a checkpoint is completed by the employees added after it
+        self.max_employee_id = 0
+
+        # incremented by every update
+        self.version = 0
+
+        # time a checkpoint loaded started to be written, the encodings changed since then are not in it
+        self.created = None
+
+        self._lock = threading.Lock()
+        self._alloc(capacity)
+
+        # employee id -> row
+        self._row_of = {}
+        self._labels = []
+        self._size = 0
+
+        self._publish()
+
+    def _alloc(self, capacity):
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._sums = np.empty((capacity, self.dim), dtype=np.float64)
+        self._counts = np.empty(capacity, dtype=np.int64)
+        self._centroids = np.empty((capacity, self.dim), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+
+        # the arrays are not referenced by the published state yet
+        self._shared = False
+
+    def _grow(self):
+        size = self._size
+        ids, sums, counts, centroids, sq_norms = self._ids, self._sums, self._counts, self._centroids, self._sq_norms
+
+        # new arrays, the published state keeps using the old ones
+        self._alloc(max(64, 2 * len(ids)))
+        self._ids[:size] = ids[:size]
+        self._sums[:size] = sums[:size]
+        self._counts[:size] = counts[:size]
+        self._centroids[:size] = centroids[:size]
+        self._sq_norms[:size] = sq_norms[:size]
+
+    def _publish(self):
+        # rows beyond the size of a published state are not read, so appending never disturbs readers
+        self._state = (self._labels, self._centroids[:self._size], self._sq_norms[:self._size])
+        self._shared = True
+        self.version += 1
+
+    def __len__(self):
+        return len(self._state[1])
+
+    def __contains__(self, employee_id):
+        return employee_id in self._row_of
+
+    def _set_row(self, row, encoding_sum, count):
+        centroid = (encoding_sum / count).astype(np.float32)
+
+        if self._shared and row < len(self._state[1]):
+            # the row is published, readers keep the old arrays until the new state is published
+            self._centroids = self._centroids.copy()
+            self._sq_norms = self._sq_norms.copy()
+            self._shared = False
+
+        self._sums[row] = encoding_sum
+        self._counts[row] = count
+        self._centroids[row] = centroid
+        self._sq_norms[row] = np.dot(centroid, centroid)
+
+    def build(self, ids, nos, encodings):
+        """
+        Replace the classes by one class for each encoding
+        :param ids: employee id of each encoding
+        :param nos: employee no of each encoding
+        :param encodings: face encodings, one row for each employee
+        """
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, self.dim)
+
+        with self._lock:
+            self._alloc(max(64, len(ids)))
+            self._row_of = {}
+            self._labels = []
+            self._size = 0
+
+            for employee_id, employee_no, encoding in zip(ids, nos, encodings):
+                self._append(int(employee_id), employee_no, encoding, 1)
+
+            self._publish()
+
+    def _append(self, employee_id, employee_no, encoding_sum, count):
+        if self._size == len(self._ids):
+            self._grow()
+
+        row = self._size
+        self._ids[row] = employee_id
+        self._set_row(row, encoding_sum, count)
+
+        self._row_of[employee_id] = row
+        self._labels.append(employee_no)
+        self._size += 1
+
+        self.max_employee_id = max(self.max_employee_id, employee_id)
+
+    def add(self, employee_id, employee_no, encoding):
+        """
+        Absorb an encoding of an employee, a new class if the employee is unknown, else one more sample of its class
+        """
+        encoding = np.asarray(encoding, dtype=np.float64).ravel()
+
+        with self._lock:
+            row = self._row_of.get(employee_id)
+
+            if row is None:
+                self._append(employee_id, employee_no, encoding, 1)
+            else:
+                self._set_row(row, self._sums[row] + encoding, self._counts[row] + 1)
+
+            self._publish()
+
+    def update(self, employee_id, encoding):
+        """
+        Replace the samples of a known employee by a new encoding, e.g. a changed avatar
+        """
+        encoding = np.asarray(encoding, dtype=np.float64).ravel()
+
+        with self._lock:
+            row = self._row_of.get(employee_id)
+            if row is None:
+                return
+
+            self._set_row(row, encoding, 1)
+            self._publish()
+
+    def predict(self, embeddings):
+        """
+        :param embeddings: face encodings
+        :return: a list of (employee_no, score) tuples, employee_no is '-1' for an unknown face
+        """
+        if len(embeddings) == 0:
+            return []
+
+        labels, centroids, sq_norms = self._state
+        if len(centroids) == 0:
+            return [('-1', 0.0)] * len(embeddings)
+
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+
+        # |a - b|^2 = |a|^2 + |b|^2 - 2ab
+        d = np.einsum('ij,ij->i', embeddings, embeddings)[:, np.newaxis] + sq_norms - \
+            2 * np.dot(embeddings, centroids.T)
+
+        best = np.argmin(d, axis=1)
+        best_distances = np.sqrt(np.maximum(d[np.arange(len(best)), best], 0))
+
+        return [(labels[j] if dist <= self.tolerance else '-1', float(1 - dist))
+                for j, dist in zip(best, best_distances)]
+
+    def save(self, path):
+        """
+        Write a checkpoint of the model, the file is replaced atomically
+        :return: the version of the model written
+        """
+        created = time.time()
+
+        with self._lock:
+            size = self._size
+            version = self.version
+            max_employee_id = self.max_employee_id
+
+            labels = list(self._labels[:size])
+            ids = self._ids[:size].copy()
+            sums = self._sums[:size].copy()
+            counts = self._counts[:size].copy()
+
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            np.savez(f, ids=ids, labels=np.array(labels), sums=sums, counts=counts,
+                     max_employee_id=np.int64(max_employee_id), created=np.float64(created))
+
+        os.rename(temp, path)
+
+        return version
+
+    @classmethod
+    def load(cls, path, tolerance=centroid_tolerance):
+        """
+        Read a checkpoint written by `save`
+        """
+        checkpoint = np.load(path)
+        try:
+            ids, labels, sums, counts = \
+                checkpoint['ids'], checkpoint['labels'].tolist(), checkpoint['sums'], checkpoint['counts']
+            max_employee_id = int(checkpoint['max_employee_id'])
+            created = float(checkpoint['created']) if 'created' in checkpoint else 0.0
+        finally:
+            checkpoint.close()
+
+        model = cls(tolerance, sums.shape[1] if sums.ndim == 2 else 128, max(64, len(sums)))
+
+        for employee_id, employee_no, encoding_sum, count in zip(ids, labels, sums, counts):
+            model._append(int(employee_id), employee_no, encoding_sum, int(count))
+
+        model.max_employee_id = max(model.max_employee_id, max_employee_id)
+        model.created = created
+        model._publish()
+
+        return model
+
+
+# model of all employees, built by `get_centroid_model`
+centroid_model = None
+_centroid_model_lock = threading.Lock()
+
+# the model of this process is updated by enrolments and polls, the other processes reload its checkpoints
+_owner = False
+_saved_version = None
+
+# largest employee id loaded from the database, a local enrolment doesn't move it so that employees
+# enrolled meanwhile by other server processes are still polled
+_polled_id = 0
+_checkpoint_mtime = None
+_checked = 0
+
+
+def _load_model():
+    global _polled_id
+
+    import snapshot
+    from db import storage
+
+    changed = [], [], []
+
+    if centroid_checkpoint and os.path.exists(centroid_checkpoint):
+        model = CentroidModel.load(centroid_checkpoint)
+        print('Loaded centroid model of {} employees from "{}"'.format(len(model), centroid_checkpoint))
+
+        changed = snapshot.load_changes(storage, model.created, model.max_employee_id)
+    else:
+        model = CentroidModel()
+
+        if snapshot.current is None:
+            model.build(*storage.load_all_employee_reps())
+        else:
+            model.build(*snapshot.current.employee_reps())
+            changed = snapshot.load_changes(storage, snapshot.current.created, snapshot.current.max_employee_id)
+
+    # encodings changed after the checkpoint or the snapshot
+    for employee_id, _, encoding in zip(*changed):
+        model.update(employee_id, encoding)
+
+    # encodings added after the checkpoint or the snapshot
+    for employee_id, employee_no, encoding in zip(*storage.load_all_employee_reps(model.max_employee_id)):
+        if employee_id not in model:
+            model.add(employee_id, employee_no, encoding)
+
+    _polled_id = model.max_employee_id
+
+    return model
+
+
+def get_centroid_model():
+    global centroid_model, _checkpoint_mtime
+
+    if not _owner and centroid_model is not None:
+        _reload()
+
+    with _centroid_model_lock:
+        if centroid_model is None:
+            if centroid_checkpoint and os.path.exists(centroid_checkpoint):
+                _checkpoint_mtime = os.path.getmtime(centroid_checkpoint)
+
+            centroid_model = _load_model()
+
+    return centroid_model
+
+
+def _reload():
+    """
+    Swap in the last checkpoint if it changed, checked every `centroid_reload_interval` seconds
+    """
+    global centroid_model, _checkpoint_mtime, _checked
+
+    now = time.time()
+    if not centroid_checkpoint or now - _checked < centroid_reload_interval:
+        return
+
+    _checked = now
+
+    try:
+        mtime = os.path.getmtime(centroid_checkpoint)
+    except OSError:
+        return
+
+    if mtime != _checkpoint_mtime:
+        _checkpoint_mtime = mtime
+        centroid_model = CentroidModel.load(centroid_checkpoint)
+
+
+def add_employee(employee_id, employee_no, encoding):
+    """
+    Absorb a new or changed encoding into the centroid model if it is built
+    :param employee_no: employee no, None to replace the encoding of a known employee
+    """
+    if centroid_model is None:
+        return
+
+    if employee_no is None:
+        centroid_model.update(employee_id, encoding)
+    else:
+        centroid_model.add(employee_id, employee_no, encoding)
+
+
+def checkpoint():
+    """
+    Write a checkpoint if the model changed since the last one, it's blocking
+    """
+    global _saved_version
+
+    model = centroid_model
+    if model is None or not centroid_checkpoint or model.version == _saved_version:
+        return
+
+    _saved_version = model.save(centroid_checkpoint)
+    print('Wrote centroid model checkpoint "{}" of {} employees'.format(centroid_checkpoint, len(model)))
+
+
+def poll():
+    """
+    Absorb the employees added by other server processes, off the reactor thread
+    """
+    from db import async_storage
+
+    model = centroid_model
+    if model is None:
+        return
+
+    def absorb(reps):
+        global _polled_id
+
+        for employee_id, employee_no, encoding in zip(*reps):
+            _polled_id = max(_polled_id, employee_id)
+
+            # already added by an enrolment on this process
+            if employee_id not in model:
+                model.add(employee_id, employee_no, encoding)
+
+    def failed(failure):
+        print('Fail to poll new encodings: {}'.format(failure.getErrorMessage()))
+
+    return async_storage.load_all_employee_reps(_polled_id).addCallbacks(absorb, failed)
+
+
+def start(checkpoint_interval=centroid_checkpoint_interval, poll_interval=centroid_poll_interval):
+    """
+    Own the model in this server process: write checkpoints every `checkpoint_interval` seconds and poll
+    the employees added by other server processes every `poll_interval` seconds. 0 disables them.
+    Worker processes forked before never own the model, they reload its checkpoints.
+    """
+    global _owner
+
+    from twisted.internet import task, threads
+
+    _owner = True
+    get_centroid_model()
+
+    def failed(failure):
+        print('Fail to write the centroid model checkpoint: {}'.format(failure.getErrorMessage()))
+
+    def write():
+        return threads.deferToThread(checkpoint).addErrback(failed)
+
+    if checkpoint_interval > 0 and centroid_checkpoint:
+        task.LoopingCall(write).start(checkpoint_interval, now=False)
+
+    if poll_interval > 0:
+        task.LoopingCall(poll).start(poll_interval, now=False)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import json
+import struct
+import uuid
+
+# reply formats negotiated on OPEN
+formats = ('full', 'compact', 'binary')
+
+# scores are sent as integers in [0, score_scale]
+score_scale = 255
+
+# binary PROCESSED reply: message type, session id (16 bytes uuid) like the header of a binary frame, flags,
+# coalesced frames (capped), number of faces, followed by the faces
+BINARY_PROCESSED = 2
+processed_header = struct.Struct('!B16sBBH')
+processed_face = struct.Struct('!hBhhhh')
+
+# flags of a binary PROCESSED reply
+FLAG_CACHED = 1
+
+# ref of an unknown face
+UNKNOWN = -1
+
+
+def quantize_score(score):
+    return int(round(min(max(float(score), 0.0), 1.0) * score_scale))
+
+
+class CompactEncoder(object):
+
+    def __init__(self):
+        """
+        Compact PROCESSED replies of a session. The metadata of an employee is sent once, in an EMPLOYEES
+        message, then a face only carries the session ref of its employee, its quantized score and its
+        box. The box is a delta from the box of the same ref in the previous reply, if that ref had exactly
+        one face in it, otherwise it's absolute. Clients apply the same rule to decode it.
+        A face is [ref, score, left, top, right, bottom], ref is -1 for an unknown face.
+        """
+        # employee no -> ref
+        self.refs = {}
+
+        # ref -> box of the previous reply, for the refs with exactly one face in it
+        self._previous = {}
+
+    def encode(self, faces):
+        """
+        :param faces: faces of the PROCESSED reply, see `FaceServerProtocol.frame_processed`
+        :return: (employees, rows), employees are the metadata of the employees seen for the first time
+                 in the session, rows are the encoded faces
+        """
+        employees = []
+        refs = []
+
+        for face in faces:
+            if face['id'] == -1:
+                refs.append(UNKNOWN)
+                continue
+
+            ref = self.refs.get(face['no'])
+            if ref is None:
+                ref = self.refs[face['no']] = len(self.refs)
+                employees.append({
+                    'ref': ref,
+                    'id': face['id'],
+                    'no': face['no'],
+                    'name': face['name'],
+                    'english_name': face['english_name'],
+                    'is_attendant': face['is_attendant']
+                })
+
+            refs.append(ref)
+
+        counts = {}
+        for ref in refs:
+            counts[ref] = counts.get(ref, 0) + 1
+
+        rows = []
+        previous = {}
+
+        for ref, face in zip(refs, faces):
+            box = [int(v) for v in face['face_location']]
+
+            if ref != UNKNOWN and counts[ref] == 1:
+                previous[ref] = box
+
+                last = self._previous.get(ref)
+                if last is not None:
+                    box = [v - w for v, w in zip(box, last)]
+
+            rows.append([ref, quantize_score(face['score'])] + box)
+
+        self._previous = previous
+
+        return employees, rows
+
+    @staticmethod
+    def to_json(rows, sess_id, coalesced=0, cached=False):
+        reply = {'type': 'PROCESSED', 'session_id': sess_id, 'f': rows}
+
+        # defaults are left out
+        if coalesced:
+            reply['c'] = coalesced
+        if cached:
+            reply['k'] = 1
+
+        return json.dumps(reply, separators=(',', ':'))
+
+    @staticmethod
+    def to_binary(rows, sess_id, coalesced=0, cached=False):
+        return processed_header.pack(BINARY_PROCESSED, uuid.UUID(sess_id).bytes, FLAG_CACHED if cached else 0,
+                                     min(coalesced, 255), len(rows)) + \
+            ''.join(processed_face.pack(*row) for row in rows)
+
+
+def employees_message(sess_id, employees):
+    """
+    :return: the EMPLOYEES message of the metadata of the employees seen for the first time in a session
+    """
+    return json.dumps({
+        'type': 'EMPLOYEES',
+        'session_id': sess_id,
+        'data': employees
+    }, separators=(',', ':'))
@@ -6,11 +6,15 @@ import os
 # global configuration
 config_parser = ConfigParser.ConfigParser()
 
-config_filename = os.path.expandvars('conf.ini')
+# FACEGO_CONF points to another config file, e.g. for benchmarks
+config_filename = os.environ.get('FACEGO_CONF') or os.path.expandvars('conf.ini')
 
 # load config file
 config_parser.read(config_filename)
 
 
-def get_prop(section, option):
+def get_prop(section, option, default=None):
+    if default is not None and not config_parser.has_option(section, option):
+        return default
+
     return config_parser.get(section, option)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import conf
+import snapshot
+
+from twisted.internet import task
+
+from db import async_storage, storage
+
+directory_poll_interval = float(conf.get_prop('directory', 'poll_interval', '30'))
+directory_full_reload_interval = float(conf.get_prop('directory', 'full_reload_interval', '3600'))
+
+
+def _max_id(employees):
+    return max([e['id'] for e in employees.itervalues()] or [0])
+
+
+class EmployeeDirectory(object):
+
+    def __init__(self):
+        """
+        Employees by employee no, refreshed in the background. The mapping is never modified in place,
+        a refresh builds a new one and swaps it in, so readers always see a consistent directory.
+        """
+        # employee no -> { 'id', 'fullname', 'english_name' }
+        self.employees = {}
+
+        # largest employee id loaded from the database, a local enrolment doesn't move it so that employees
+        # enrolled meanwhile by other server processes are still polled
+        self.polled_id = 0
+
+        self._polling = False
+        self._loops = []
+
+    def __len__(self):
+        return len(self.employees)
+
+    def get(self, employee_no, default=None):
+        return self.employees.get(employee_no, default)
+
+    def put(self, employee_no, employee):
+        """
+        Add or replace an employee, e.g. pushed by the web controllers after an enrolment
+        """
+        employees = dict(self.employees)
+        employees[employee_no] = employee
+
+        self.employees = employees
+
+    def load(self):
+        """
+        Load all employees, from the snapshot plus the employees added after it if a snapshot is used.
+        It's blocking
+        """
+        if snapshot.current is None:
+            employees = storage.load_all_employees()
+        else:
+            employees = snapshot.current.employees()
+            employees.update(storage.load_all_employees(snapshot.current.max_employee_id))
+
+        self.employees = employees
+        self.polled_id = _max_id(employees)
+
+    def poll(self, full=False):
+        """
+        Load the employees added since the last poll, or all employees if full, off the reactor thread
+        :return: a Deferred fired when the new directory is swapped in
+        """
+        if self._polling:
+            return
+
+        self._polling = True
+
+        d = async_storage.load_all_employees(None if full else self.polled_id)
+
+        def swap(delta):
+            self.polled_id = max(self.polled_id, _max_id(delta))
+
+            if full:
+                self.employees = delta
+            elif len(delta) > 0:
+                employees = dict(self.employees)
+                employees.update(delta)
+
+                self.employees = employees
+                print('{} employees added to directory'.format(len(delta)))
+
+        def failed(failure):
+            print('Fail to refresh employee directory: {}'.format(failure.getErrorMessage()))
+
+        d.addCallbacks(swap, failed)
+        d.addBoth(self._polled)
+        return d
+
+    def _polled(self, _):
+        self._polling = False
+
+    def start(self, poll_interval=directory_poll_interval, full_reload_interval=directory_full_reload_interval):
+        """
+        Start polling new employees every `poll_interval` seconds, and reloading all employees every
+        `full_reload_interval` seconds to pick up changed or removed ones. 0 disables the polling.
+        """
+        if poll_interval > 0:
+            loop = task.LoopingCall(self.poll)
+            loop.start(poll_interval, now=False)
+            self._loops.append(loop)
+
+        if full_reload_interval > 0:
+            loop = task.LoopingCall(self.poll, True)
+            loop.start(full_reload_interval, now=False)
+            self._loops.append(loop)
+
+    def stop(self):
+        for loop in self._loops:
+            loop.stop()
+
+        self._loops = []
+
+
+# directory of all employees
+employee_directory = EmployeeDirectory()
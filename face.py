@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 
 import conf
+import cv2
 import dlib
+import metrics
 import numpy as np
 
 dlib_face_predictor_model_location = conf.get_prop('dlib', 'dlib_face_predictor_model_location')
 dlib_face_recognition_model_location = conf.get_prop('dlib', 'dlib_face_recognition_model_location')
 
+dlib_detect_mode = conf.get_prop('dlib', 'detect_mode', 'full')
+dlib_detect_scale = float(conf.get_prop('dlib', 'detect_scale', '0.5'))
+dlib_detect_upsample = int(conf.get_prop('dlib', 'detect_upsample', '1'))
+
 
 def _rect_to_css(rect):
     return rect.left(), rect.top(), rect.right(), rect.bottom()
@@ -20,6 +26,10 @@ def _trim_css_to_bounds(css, image_shape):
     return max(css[0], 0), max(css[1], 0), min(css[2], image_shape[1]), min(css[3], image_shape[0])
 
 
+def _scale_css(css, scale):
+    return tuple(int(round(v / scale)) for v in css)
+
+
 def compare_faces(known_face_encodings, face_encoding_to_check):
     if len(known_face_encodings) == 0:
         return np.empty(0)
@@ -47,7 +57,15 @@ class FaceApi(object):
 
 class FaceDlibApi(FaceApi):
 
-    def __init__(self):
+    def __init__(self, detect_scale=1.0, detect_upsample=1):
+        """
+        :param detect_scale: default scale of the copy of image faces are detected on, 1.0 detects on the full image
+        :param detect_upsample: default number of times to upsample the downscaled copy when detecting faces,
+                                detection on the full image always upsamples once by default
+        """
+        self.detect_scale = detect_scale
+        self.detect_upsample = detect_upsample
+
         # face detector
         self.face_detector = dlib.get_frontal_face_detector()
 
@@ -71,15 +89,55 @@ class FaceDlibApi(FaceApi):
 
         return [self.face_predictor(img, face_location) for face_location in face_locations]
 
-    def detect_faces(self, img, number_of_times_to_upsample=1):
+    def detect_faces(self, img, number_of_times_to_upsample=None, scale=None):
         """
         :param number_of_times_to_upsample: How many times to upsample the image looking for faces.
                                             Higher numbers find smaller faces.
         :type number_of_times_to_upsample: int
+        :param scale: Detect faces on a copy of the image resized by scale, which is much faster than detecting
+                      on the full image. Locations are mapped back to the full image.
+        :type scale: float
         :return A list of tuples of found face locations in css (left, top, right, bottom) order
         """
-        return [_trim_css_to_bounds(_rect_to_css(face), img.shape) for face
-                in self._raw_face_locations(img, number_of_times_to_upsample)]
+        with metrics.stage('detect'):
+            return self._detect_faces(img, number_of_times_to_upsample, scale)
+
+    def _detect_faces(self, img, number_of_times_to_upsample, scale):
+        if scale is None:
+            scale = self.detect_scale
+
+        if number_of_times_to_upsample is None:
+            # the upsample option only applies to the downscaled mode, the full mode is unchanged
+            number_of_times_to_upsample = 1 if scale >= 1.0 else self.detect_upsample
+
+        if scale >= 1.0:
+            return [_trim_css_to_bounds(_rect_to_css(face), img.shape) for face
+                    in self._raw_face_locations(img, number_of_times_to_upsample)]
+
+        small = cv2.resize(img, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        return self._detect_faces_on_copy(small, img.shape, number_of_times_to_upsample)
+
+    def detect_faces_on_copy(self, small, shape, number_of_times_to_upsample=None):
+        """
+        Detect faces on a downscaled copy of an image, e.g. a frame decoded at a reduced size, so that the full
+        image is only needed when faces are encoded.
+        :param small: the downscaled copy
+        :param shape: shape of the full image, locations are mapped back to it
+        :param number_of_times_to_upsample: How many times to upsample the copy looking for faces.
+        :return A list of tuples of found face locations in css (left, top, right, bottom) order
+        """
+        if number_of_times_to_upsample is None:
+            number_of_times_to_upsample = self.detect_upsample
+
+        with metrics.stage('detect'):
+            return self._detect_faces_on_copy(small, shape, number_of_times_to_upsample)
+
+    def _detect_faces_on_copy(self, small, shape, number_of_times_to_upsample):
+        scale = float(small.shape[1]) / shape[1]
+
+        return [_trim_css_to_bounds(_scale_css(_rect_to_css(face), scale), shape) for face
+                in self._raw_face_locations(small, number_of_times_to_upsample)]
 
     def face_encodings(self, img, known_face_locations=None, num_jitters=1):
         """
@@ -90,10 +148,38 @@ class FaceDlibApi(FaceApi):
                             , but slower (i.e. 100 is 100x slower)
         :return: A list of 128-dimentional face encodings (one for each face in the image)
         """
-        raw_landmarks = self._raw_face_landmarks(img, known_face_locations)
+        with metrics.stage('landmarks'):
+            raw_landmarks = self._raw_face_landmarks(img, known_face_locations)
+
+        with metrics.stage('descriptor'):
+            return np.array([self.face_encoder.compute_face_descriptor(img, raw_landmark_set, num_jitters)
+                             for raw_landmark_set in raw_landmarks])
 
-        return np.array([self.face_encoder.compute_face_descriptor(img, raw_landmark_set, num_jitters)
-                         for raw_landmark_set in raw_landmarks])
+    def batch_face_encodings(self, imgs, known_face_locations, num_jitters=1):
+        """
+        Return the face encodings of several images at once, landmarking and encoding are run as a single batch.
+        :param imgs: A list of images
+        :param known_face_locations: The bounding boxes of faces for each image
+        :param num_jitters: How many times to re-sample the face when calculating encoding
+        :return: A list of numpy ndarray of 128-dimentional face encodings (one ndarray for each image)
+        """
+        batch_landmarks = []
+        with metrics.stage('landmarks'):
+            for img, face_locations in zip(imgs, known_face_locations):
+                landmarks = dlib.full_object_detections()
+                landmarks.extend(self._raw_face_landmarks(img, face_locations))
+                batch_landmarks.append(landmarks)
+
+        with metrics.stage('descriptor'):
+            try:
+                # the batch overload of dlib >= 19.13
+                descriptors = self.face_encoder.compute_face_descriptor(imgs, batch_landmarks, num_jitters)
+            except TypeError:
+                descriptors = [[self.face_encoder.compute_face_descriptor(img, raw_landmark_set, num_jitters)
+                                for raw_landmark_set in landmarks]
+                               for img, landmarks in zip(imgs, batch_landmarks)]
+
+        return [np.array(d).reshape(-1, 128) for d in descriptors]
 
     def face_distance(self, face_encodings, face_to_compare):
         """
@@ -119,5 +205,5 @@ class FaceDlibApi(FaceApi):
 
 
 # using dlib api
-api = FaceDlibApi()
+api = FaceDlibApi(dlib_detect_scale if dlib_detect_mode == 'downscale' else 1.0, dlib_detect_upsample)
 
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import time
+import conf
+
+cache_enabled = conf.get_prop('cache', 'enabled', 'true').lower() == 'true'
+cache_size = int(conf.get_prop('cache', 'size', '16'))
+cache_ttl = float(conf.get_prop('cache', 'ttl', '2'))
+cache_max_distance = int(conf.get_prop('cache', 'max_distance', '3'))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class ResultCache(object):
+
+    def __init__(self, size=cache_size, ttl=cache_ttl, max_distance=cache_max_distance):
+        """
+        Results of the recent frames of a session by perceptual hash, so that a near-duplicate frame
+        (e.g. of a static camera while nobody moves) reuses the result instead of being processed.
+        A result is kept for `ttl` seconds after its frame was processed, a hit doesn't extend it, so
+        the pipeline still runs at least every `ttl` seconds on a static scene.
+        :param size: max number of results, the oldest is evicted first
+        :param ttl: seconds a result is reused
+        :param max_distance: max hamming distance between the hashes of two frames to be near-duplicates
+        """
+        self.size = size
+        self.ttl = ttl
+        self.max_distance = max_distance
+
+        # [hash, result, time] from the oldest to the newest
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        entries = self._entries
+
+        i = 0
+        while i < len(entries) and now - entries[i][2] > self.ttl:
+            i += 1
+
+        if i > 0:
+            del entries[:i]
+
+    def get(self, frame_hash):
+        """
+        :return: the result of the closest near-duplicate frame, or None
+        """
+        self._expire(time.time())
+
+        best = None
+        best_distance = self.max_distance + 1
+
+        for entry in self._entries:
+            distance = hamming(frame_hash, entry[0])
+            if distance < best_distance:
+                best, best_distance = entry, distance
+
+        return best[1] if best is not None else None
+
+    def put(self, frame_hash, result):
+        now = time.time()
+        self._expire(now)
+
+        # a result replaces the one of the same frame
+        self._entries = [entry for entry in self._entries if entry[0] != frame_hash]
+        self._entries.append([frame_hash, result, now])
+
+        if len(self._entries) > self.size:
+            del self._entries[:len(self._entries) - self.size]
+
+    def clear(self):
+        self._entries = []
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import cStringIO as StringIO
+import cv2
+import numpy as np
+
+from PIL import Image
+
+# data_url head
+data_url_head = 'data:image/jpeg;base64,'
+
+# images are decoded like PIL did: converted to color, EXIF orientation not applied
+decode_flags = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+
+
+class FrameDecoder(object):
+    """
+    Decode JPEG frames read in place from the messages. Full size frames are decoded by OpenCV, reduced size
+    ones by PIL in draft mode: the JPEG is decoded at 1/2, 1/4 or 1/8 of its size by skipping the DCT
+    coefficients, which is several times faster than decoding at full size then resizing. cv2.imdecode
+    can't do it, it ignores the IMREAD_REDUCED_* flags that only cv2.imread honours.
+    """
+
+    def decode(self, data, offset=0):
+        """
+        :param data: JPEG bytes, or a message containing them
+        :param offset: offset of the JPEG bytes in data, they are read in place
+        :return: RGB image of shape (height, width, 3)
+        :rtype: numpy.ndarray
+        """
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8, offset=offset), decode_flags)
+        if img is None:
+            raise IOError('Cannot decode image of {} bytes'.format(len(data) - offset))
+
+        # BGR to RGB in place, the decoded array is the only one allocated
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+
+    def _open(self, data, offset):
+        """
+        :return: PIL image, only the header is read until it's converted
+        """
+        return Image.open(StringIO.StringIO(buffer(data, offset)))
+
+    def decode_reduced(self, data, offset=0, scale=0.5):
+        """
+        Decode a frame at a reduced size, e.g. to detect faces on a downscaled copy
+        :param data: JPEG bytes, or a message containing them
+        :param offset: offset of the JPEG bytes in data
+        :param scale: scale of the decoded image, the nearest larger reduced size is resized to it
+        :return: (RGB image, (height, width) of the full size frame)
+        """
+        im = self._open(data, offset)
+        width, height = im.size
+        size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+
+        im.draft('RGB', size)
+        img = np.array(im.convert('RGB'))
+        if img.shape[1::-1] != size:
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+        return img, (height, width)
+
+    def dhash(self, data, offset=0, hash_size=8):
+        """
+        Difference hash of a frame: the signs of the horizontal gradients of a tiny grayscale thumbnail.
+        Near-duplicate frames have hashes at a small hamming distance. Only the luma is decoded, at 1/8
+        of the size, so it's much cheaper than `decode`.
+        :param data: JPEG bytes, or a message containing them
+        :param offset: offset of the JPEG bytes in data
+        :param hash_size: the hash has hash_size * hash_size bits
+        :return: the hash
+        :rtype: long
+        """
+        size = (hash_size + 1, hash_size)
+        im = self._open(data, offset)
+        im.draft('L', size)
+        gray = np.asarray(im.convert('L'))
+
+        pixels = cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+        return long(''.join('1' if bit else '0' for bit in (pixels[:, 1:] > pixels[:, :-1]).flat), 2)
+
+    def decode_data_url(self, data):
+        """
+        :param data: data_url of a JPEG image
+        :return: RGB image, see `decode`
+        """
+        return self.decode(base64.b64decode(data[len(data_url_head):]))
+
+
+# shared decoder
+decoder = FrameDecoder()
+
+
+def _jpeg(data, offset):
+    if offset is None:
+        return base64.b64decode(data[len(data_url_head):]), 0
+
+    return data, offset
+
+
+def decode_frame(data, offset=None):
+    """
+    :param data: a data_url, or a binary message if offset is given
+    :param offset: offset of the raw JPEG bytes in a binary message
+    :return: RGB image
+    :rtype: numpy.ndarray
+    """
+    return decoder.decode(*_jpeg(data, offset))
+
+
+def decode_frame_reduced(data, offset=None, scale=0.5):
+    """
+    :param data: a data_url, or a binary message if offset is given
+    :param offset: offset of the raw JPEG bytes in a binary message
+    :param scale: scale of the decoded image
+    :return: (RGB image, (height, width) of the full size frame), see `FrameDecoder.decode_reduced`
+    """
+    data, offset = _jpeg(data, offset)
+
+    return decoder.decode_reduced(data, offset, scale)
+
+
+def frame_hash(data, offset=None):
+    """
+    :param data: a data_url, or a binary message if offset is given
+    :param offset: offset of the raw JPEG bytes in a binary message
+    :return: perceptual hash of the frame, see `FrameDecoder.dhash`
+    """
+    data, offset = _jpeg(data, offset)
+
+    return decoder.dhash(data, offset)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class AttendantMatcher(object):
+
+    def __init__(self, labels, encodings, tolerance=0.6):
+        """
+        Nearest neighbour matching of faces against the encodings of the attendants of a meeting
+        :param labels: employee no of each encoding
+        :param encodings: 128-dimensional face encodings of the attendants
+        :param tolerance: max distance between two faces to be a match
+        """
+        self.labels = list(labels)
+        self.tolerance = tolerance
+
+        # contiguous float32 matrix, one row for each attendant
+        self.encodings = np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(-1, 128))
+        self._sq_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def distances(self, embeddings):
+        """
+        :param embeddings: face encodings of a frame
+        :return: matrix of euclidean distances, one row for each face and one column for each attendant
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, 128)
+
+        # |a - b|^2 = |a|^2 + |b|^2 - 2ab
+        d = np.einsum('ij,ij->i', embeddings, embeddings)[:, np.newaxis] + self._sq_norms - \
+            2 * np.dot(embeddings, self.encodings.T)
+
+        return np.sqrt(np.maximum(d, 0, out=d), out=d)
+
+    def match(self, embeddings):
+        """
+        Match all faces of a frame at once
+        :param embeddings: face encodings of a frame
+        :return: a list of (employee_no, score) tuples, employee_no is '-1' for an unknown face
+        """
+        if len(embeddings) == 0:
+            return []
+
+        if len(self.labels) == 0:
+            return [('-1', 0.0)] * len(embeddings)
+
+        d = self.distances(embeddings)
+
+        best = np.argmin(d, axis=1)
+        best_distances = d[np.arange(len(best)), best]
+
+        return [(self.labels[j] if dist <= self.tolerance else '-1', float(1 - dist))
+                for j, dist in zip(best, best_distances)]
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import threading
+import time
+
+# latency buckets in seconds
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    if isinstance(value, (int, long)):
+        return str(value)
+
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+class Counter(object):
+
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def samples(self):
+        return [(self.name, (), self.value)]
+
+
+class Gauge(object):
+
+    type = 'gauge'
+
+    def __init__(self, name, help, fn=None):
+        """
+        :param fn: function returning the current value, instead of setting it
+        """
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, n=1):
+        # only changed on the reactor thread
+        self.value += n
+
+    def dec(self, n=1):
+        self.value -= n
+
+    def samples(self):
+        return [(self.name, (), self.fn() if self.fn is not None else self.value)]
+
+
+class Rate(object):
+
+    type = 'gauge'
+
+    def __init__(self, name, help, window=10):
+        """
+        Events per second over the last `window` seconds, counted in one bucket per second
+        """
+        self.name = name
+        self.help = help
+        self.window = window
+
+        # [second, count] of each bucket
+        self._buckets = [[0, 0] for _ in range(window)]
+        self._lock = threading.Lock()
+
+    def mark(self, n=1):
+        now = int(time.time())
+        bucket = self._buckets[now % self.window]
+
+        with self._lock:
+            if bucket[0] != now:
+                bucket[0] = now
+                bucket[1] = 0
+            bucket[1] += n
+
+    def value(self):
+        now = int(time.time())
+
+        return float(sum(count for second, count in self._buckets if now - second < self.window)) / self.window
+
+    def samples(self):
+        return [(self.name, (), self.value())]
+
+
+class Histogram(object):
+
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=default_buckets, label=None):
+        """
+        :param buckets: upper bounds of the buckets
+        :param label: name of the label telling the series apart, e.g. 'stage'
+        """
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+
+        # label value -> [bucket counts, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value=None):
+        i = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            series[0][i] += 1
+            series[1] += value
+
+    def samples(self):
+        samples = []
+
+        with self._lock:
+            series = sorted((label_value, list(counts), total) for label_value, (counts, total)
+                            in self._series.iteritems())
+
+        for label_value, counts, total in series:
+            labels = ((self.label, label_value),) if self.label is not None else ()
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels + (('le', _format_value(bound)),), cumulative))
+
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, cumulative))
+
+        return samples
+
+
+class Registry(object):
+
+    def __init__(self):
+        """
+        Metrics of this process, rendered in the Prometheus text format
+        """
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    'facego_stage_seconds', 'Time spent in each stage of the frame pipeline', label='stage'))
+frame_seconds = registry.register(Histogram(
+    'facego_frame_seconds', 'Time from submitting a frame to the workers to sending its reply'))
+
+frames_received = registry.register(Counter('facego_frames_received_total', 'Frames received'))
+frames_processed = registry.register(Counter('facego_frames_processed_total', 'Frames processed and replied'))
+frames_coalesced = registry.register(Counter(
+    'facego_frames_coalesced_total', 'Stale frames dropped in favour of a newer frame of the same session'))
+frames_busy = registry.register(Counter('facego_frames_busy_total', 'Frames dropped because the workers were busy'))
+frames_cached = registry.register(Counter(
+    'facego_frames_cached_total', 'Near-duplicate frames replied with the cached result of a previous frame'))
+frames_failed = registry.register(Counter('facego_frames_failed_total', 'Frames whose processing failed'))
+frames_per_second = registry.register(Rate('facego_frames_per_second', 'Frames processed per second'))
+
+active_sessions = registry.register(Gauge('facego_active_sessions', 'Open meeting sessions'))
+queue_depth = registry.register(Gauge('facego_queue_depth', 'Jobs submitted to the workers and not finished'))
+
+# timings of the job running on this thread, see `measured`
+_job = threading.local()
+
+
+class stage(object):
+
+    def __init__(self, name):
+        """
+        Time a stage of the pipeline:
+
+            with metrics.stage('detect'):
+                ...
+
+        Inside a job run by `measured` the timing is returned with the result of the job, so that
+        it's recorded by the server process even if the job runs on a worker process.
+        """
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *_):
+        record(self.name, time.time() - self.start)
+
+
+def record(name, seconds):
+    timings = getattr(_job, 'timings', None)
+
+    if timings is None:
+        stage_seconds.observe(seconds, name)
+    else:
+        timings.append((name, seconds))
+
+
+def measured(submitted, fn, *args, **kwargs):
+    """
+    Run a job on a worker and collect the timings of its stages
+    :param submitted: time the job was submitted, to measure the time it waited for a worker
+    :return: (result of the job, timings), timings is a list of (stage, seconds)
+    """
+    start = time.time()
+    _job.timings = [('queue', start - submitted)]
+
+    try:
+        result = fn(*args, **kwargs)
+        _job.timings.append(('job', time.time() - start))
+
+        return result, _job.timings
+    finally:
+        _job.timings = None
+
+
+def observe(timings):
+    """
+    Record the timings returned by `measured`
+    """
+    for name, seconds in timings:
+        stage_seconds.observe(seconds, name)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import os
+import signal
+import socket
+import sys
+
+# the kernel spreads connections over the sockets of the workers
+has_reuseport = hasattr(socket, 'SO_REUSEPORT')
+
+
+def reuseport_socket(iface, port, backlog=50):
+    """
+    A listening socket that other processes can bind to the same address, the kernel then spreads the
+    incoming connections over them. Falls back to a plain socket where SO_REUSEPORT is not supported,
+    it must then be created before forking to be shared.
+    :return: the non-blocking socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    if has_reuseport:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    sock.bind((iface, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+
+    return sock
+
+
+def adopt_port(reactor, sock, factory):
+    """
+    Listen on a socket created by `reuseport_socket`, the socket is closed as the reactor has its own copy
+    :return: the listening port
+    """
+    port = reactor.adoptStreamPort(sock.fileno(), socket.AF_INET, factory)
+    sock.close()
+
+    return port
+
+
+class Supervisor(object):
+
+    def __init__(self, workers):
+        """
+        Fork worker processes, the parent waits for them and forwards SIGINT and SIGTERM.
+        Everything loaded before `fork` is shared copy-on-write by the workers, nothing that
+        owns threads, sockets or a reactor must be created before it.
+        :param workers: number of worker processes
+        :type workers: int.
+        """
+        assert workers > 0
+
+        self.workers = workers
+
+        # pid -> worker index
+        self.children = {}
+
+        self._stopping = False
+
+    def fork(self):
+        """
+        :return: the index of the worker in a worker process, None in the parent once all the workers exited
+        """
+        for index in range(self.workers):
+            pid = self._spawn(index)
+            if pid == 0:
+                return index
+
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        return self._wait()
+
+    def _spawn(self, index):
+        sys.stdout.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            # the worker's reactor installs its own handlers
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+            self.children = {}
+            return 0
+
+        self.children[pid] = index
+        print('Forked worker {} (pid {})'.format(index, pid))
+
+        return pid
+
+    def _wait(self):
+        """
+        :return: the index of a replaced worker in its new process, None in the parent once all the workers exited
+        """
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+
+            index = self.children.pop(pid, None)
+            if index is None:
+                continue
+
+            print('Worker {} (pid {}) exited with status {}'.format(index, pid, status))
+
+            # replace a crashed worker
+            if not self._stopping and status != 0:
+                if self._spawn(index) == 0:
+                    # the new worker leaves the supervisor loop
+                    return index
+
+        return None
+
+    def _stop(self, signum, _):
+        self._stopping = True
+
+        for pid in self.children.keys():
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+
+def fork_workers(workers):
+    """
+    Fork `workers` processes and supervise them
+    :return: the index of the worker in a worker process, None in the parent once all the workers exited
+    """
+    return Supervisor(workers).fork()
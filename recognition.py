@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+import cPickle as pickle
+import numpy as np
+import uuid
+import conf
+import metrics
+
+from skimage import io
+
+from centroid import get_centroid_model
+from face import api
+from imgdecode import decode_frame, decode_frame_reduced
+from tracker import match_tracks
+
+
+# 'pickle' loads the classifier trained offline, 'centroid' uses the centroid model updated on enrolment
+classifier_type = conf.get_prop('classifier', 'type', 'pickle')
+
+if classifier_type == 'pickle':
+    # load classifier model
+    classifier_filename = conf.get_prop('classifier', 'model_location')
+    with open(classifier_filename, 'rb') as infile:
+        (classifier_model, classes) = pickle.load(infile)
+        print 'Loaded classifier model from file "%s"' % classifier_filename
+
+
+def recognize(data, offset=None, save_data=False, tracked_locations=None, matcher=None):
+    """
+    Faces recognition of one frame. It's blocking, run it on a worker thread or process
+    :param data: data_url, or a binary message if offset is given
+    :param offset: offset of the raw JPEG bytes in a binary message
+    :param save_data: save data on the disk if true
+    :param tracked_locations: locations of tracked faces whose classification can be reused,
+                              faces linked to one of them are not encoded
+    :param matcher: match faces against the meeting attendants instead of using the classifier
+    :type matcher: matcher.AttendantMatcher
+    :return: a list of (face_location, employee_no, score, track) tuples, track is the index in
+             `tracked_locations` of a reused face (employee_no and score are None), or None
+    """
+    return recognize_batch([(data, offset, save_data, tracked_locations, matcher)])[0]
+
+
+def classify(embeddings):
+    """
+    :param embeddings: face encodings
+    :return: a list of (employee_no, score) tuples given by the classifier
+    """
+    if len(embeddings) == 0:
+        return []
+
+    if classifier_type == 'centroid':
+        with metrics.stage('centroid'):
+            return get_centroid_model().predict(embeddings)
+
+    with metrics.stage('predict_proba'):
+        predictions = classifier_model.predict_proba(embeddings)
+
+    best_class_indices = np.argmax(predictions, axis=1)
+    best_class_probabilities = predictions[np.arange(len(best_class_indices)), best_class_indices]
+
+    return [(classes[best_class_indices[i]], float(best_class_probabilities[i])) for i in range(len(best_class_indices))]
+
+
+def recognize_batch(frames):
+    """
+    Faces recognition of several frames, possibly of different sessions. Faces of all frames are
+    encoded and classified as a single batch. It's blocking, run it on a worker thread or process
+    :param frames: a list of arguments of `recognize`
+    :return: a list of results of `recognize` (one for each frame)
+    """
+    imgs = []
+    face_locations = []
+
+    for data, offset, save_data, tracked, _ in frames:
+        assert data is not None
+
+        locations = None
+
+        if api.detect_scale < 1.0 and not save_data:
+            # faces are detected on a copy decoded at the detection size, the full frame is only decoded
+            # if some face must be encoded
+            with metrics.stage('decode'):
+                small, shape = decode_frame_reduced(data, offset, api.detect_scale)
+
+            locations = api.detect_faces_on_copy(small, shape)
+            if all(m is not None for m in match_tracks(locations, tracked)):
+                imgs.append(None)
+                face_locations.append(locations)
+                continue
+
+        with metrics.stage('decode'):
+            img = decode_frame(data, offset)
+
+        if save_data:
+            import os
+            import tempfile
+
+            filename = os.path.join(tempfile.gettempdir(), str(uuid.uuid1()) + ".jpg")
+            io.imsave(filename, img)
+
+        imgs.append(img)
+        face_locations.append(locations)
+
+    return recognize_images(imgs, [frame[3] for frame in frames], [frame[4] for frame in frames], face_locations)
+
+
+def recognize_images(imgs, tracked_locations=None, matchers=None, face_locations=None):
+    """
+    Faces recognition of decoded images, encoded and classified as a single batch. It's blocking
+    :param imgs: RGB images, an image can be None if all its faces are linked to tracked faces
+    :param tracked_locations: for each image, locations of tracked faces whose classification can be reused
+    :param matchers: for each image, the matcher of its faces or None to use the classifier
+    :param face_locations: for each image, the locations of its faces if already detected, or None
+    :return: a list of results of `recognize` (one for each image)
+    """
+    if tracked_locations is None:
+        tracked_locations = [None] * len(imgs)
+
+    if matchers is None:
+        matchers = [None] * len(imgs)
+
+    if face_locations is None:
+        face_locations = [None] * len(imgs)
+
+    encoded_imgs = []
+    locations = []
+    detections = []
+
+    for img, tracked, know_face_locations in zip(imgs, tracked_locations, face_locations):
+        if know_face_locations is None:
+            know_face_locations = api.detect_faces(img)
+        matches = match_tracks(know_face_locations, tracked)
+
+        # only new or moved faces are encoded
+        new_face_locations = [l for l, m in zip(know_face_locations, matches) if m is None]
+        if len(new_face_locations) > 0:
+            encoded_imgs.append(img)
+            locations.append(new_face_locations)
+
+        detections.append((know_face_locations, matches, len(new_face_locations)))
+
+    encodings = iter(api.batch_face_encodings(encoded_imgs, locations) if len(encoded_imgs) > 0 else [])
+    embeddings = [next(encodings) if n > 0 else np.empty((0, 128)) for _, _, n in detections]
+
+    # frames using the classifier are classified as one batch
+    classified = [None] * len(imgs)
+    batch = [k for k, matcher in enumerate(matchers) if matcher is None and len(embeddings[k]) > 0]
+    if len(batch) > 0:
+        labels = iter(classify(np.concatenate([embeddings[k] for k in batch])))
+        for k in batch:
+            classified[k] = [next(labels) for _ in range(len(embeddings[k]))]
+
+    # split the batch back into frames
+    results = []
+    for k, (know_face_locations, matches, _) in enumerate(detections):
+        matcher = matchers[k]
+        if matcher is not None:
+            with metrics.stage('match'):
+                labels = iter(matcher.match(embeddings[k]))
+        else:
+            labels = iter(classified[k] or [])
+
+        faces = []
+        for face_location, track in zip(know_face_locations, matches):
+            if track is not None:
+                faces.append((face_location, None, None, track))
+            else:
+                employee_no, score = next(labels)
+                faces.append((face_location, employee_no, score, None))
+
+        results.append(faces)
+
+    return results
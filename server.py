@@ -1,57 +1,112 @@
 # -*- coding: utf-8 -*-
 
-import base64
-import cStringIO as StringIO
 import json
+import os
+import struct
 import sys
+import time
 import click
 import uuid
-import numpy as np
-import conf
-import cPickle as pickle
 
 from twisted.internet import ssl
 from autobahn.twisted.websocket import WebSocketServerFactory, WebSocketServerProtocol, listenWS
-from PIL import Image
-from skimage import io
 
-from db import storage
-from face import api
-from web import get_site
+import ann
+import centroid
+import metrics
+
+from ann import IndexMatcher, get_employee_index, init_worker
+from attendance import Attendance
+from compact import CompactEncoder, employees_message, formats, score_scale
+from db import async_storage, storage
+from directory import employee_directory
+from framecache import ResultCache, cache_enabled
+from imgdecode import frame_hash
+from matcher import AttendantMatcher
+from prefork import adopt_port, fork_workers, has_reuseport, reuseport_socket
+from recognition import classifier_type, recognize_batch
+from snapshot import default_snapshot_path, use_snapshot
+from tracker import FaceTracker, tracker_enabled, tracker_refresh_interval
+from web import create_enroll_pool, get_site, web_enroll_workers
+from worker import Batcher, FrameScheduler, WorkerPool, WorkerPoolBusy
 
 import txaio
 txaio.use_twisted()
 
 
-# load classifier model
-classifier_filename = conf.get_prop('classifier', 'model_location')
-with open(classifier_filename, 'rb') as infile:
-    (classifier_model, classes) = pickle.load(infile)
-    print 'Loaded classifier model from file "%s"' % classifier_filename
+# header of a binary message: message type, session id (16 bytes uuid), followed by raw JPEG bytes
+binary_header = struct.Struct('!B16s')
 
-# load all employees info [ employee_no, employee_fullname ]
-all_employees = storage.load_all_employees()
-print 'There are %d employees in total' % len(all_employees)
+# binary message types
+BINARY_PROCESSING = 1
+
+
+def load_session(meeting_id, tolerance=0.6, match='classifier'):
+    """
+    Load what a meeting session needs from the database, it's blocking
+    :param meeting_id: the unique identity of meeting
+    :type meeting_id: int
+    :param match: 'classifier' recognizes faces with the classifier trained on all employees,
+                  'attendants' matches faces against the encodings of the meeting attendants,
+                  'index' matches faces against the encodings of all employees
+    :type match: str
+    :return: ids of the participants and the matcher of the session (None for the classifier)
+    """
+    assert match in ('classifier', 'attendants', 'index')
+
+    if match == 'attendants':
+        # load all participants of a meeting with their face encodings
+        ids, nos, _, reps = storage.load_attendants(meeting_id)
+
+        return ids, AttendantMatcher(nos, reps, tolerance)
+
+    # load all participants of a meeting
+    attendants = storage.load_attendants_by_meeting_id(meeting_id)
+
+    return attendants, IndexMatcher(get_employee_index(), tolerance) if match == 'index' else None
 
 
 class Session:
 
-    def __init__(self, meeting_id, tolerance=0.6):
+    def __init__(self, meeting_id, attendants, matcher=None, tolerance=0.6, replies='frames', reply_format='full'):
         """
         :param meeting_id: the unique identity of meeting
         :type meeting_id: int
+        :param attendants: ids of all participants of the meeting
+        :param matcher: matches faces instead of the classifier, see `load_session`
+        :param replies: 'frames' replies PROCESSED to every frame and ATTENDANCE to the changes of attendance,
+                        'attendance' only replies ATTENDANCE
+        :param reply_format: format of the PROCESSED replies, 'full' dicts, or ids, quantized scores and box
+                             deltas as 'compact' JSON or 'binary', see `compact.CompactEncoder`
         """
+        assert replies in ('frames', 'attendance')
+        assert reply_format in formats
         assert meeting_id is not None
         self.meeting_id = meeting_id
 
         self.tolerance = tolerance
 
-        # load all participants of a meeting
-        self.attendants = storage.load_attendants_by_meeting_id(meeting_id)
+        self.attendants = attendants
+        self.matcher = matcher
+        self.replies = replies
+        self.reply_format = reply_format
+        self.encoder = CompactEncoder() if reply_format != 'full' else None
 
         # generate unique session id
         self.id = str(uuid.uuid1())
 
+        # frames waiting for processing
+        self.frames = FrameScheduler()
+
+        # faces tracked across frames, a tracked face is only encoded again every refresh interval
+        self.tracker = FaceTracker(refresh_interval=tracker_refresh_interval if tracker_enabled else 0)
+
+        # attendance smoothed over the recent frames
+        self.attendance = Attendance(attendants)
+
+        # replies of the recent frames, reused by near-duplicate frames
+        self.cache = ResultCache() if cache_enabled else None
+
         print("Meeting session created! session_id: {}, meeting_id: {}, participants: {}"
               .format(self.id, self.meeting_id, self.attendants))
 
@@ -71,13 +126,18 @@ class FaceServerProtocol(WebSocketServerProtocol):
         print('WebSocket connection open.')
 
     def onMessage(self, payload, is_binary):
+        if is_binary:
+            self.on_binary_message(payload)
+            return
+
         raw = payload.decode('utf8')
         msg = json.loads(raw)
 
         print("Received {} message of length {}.".format(msg['type'], len(raw)))
 
         if msg['type'] == 'OPEN':
-            self.open_session(msg['meeting_id'])
+            self.open_session(msg['meeting_id'], msg.get('match', 'classifier'), msg.get('replies', 'frames'),
+                              msg.get('format', 'full'))
         elif msg['type'] == 'CLOSE':
             self.close_session(msg['session_id'])
         elif msg['type'] == 'PROCESSING':
@@ -85,28 +145,88 @@ class FaceServerProtocol(WebSocketServerProtocol):
         else:
             print('Unknown type: {}', msg['type'])
 
+    def on_binary_message(self, payload):
+        """
+        Binary message: a fixed header followed by the raw JPEG bytes of a frame
+        :param payload: binary message
+        :return:
+        """
+        if len(payload) <= binary_header.size:
+            print('Binary message too short: {}'.format(len(payload)))
+            return
+
+        msg_type, sess_id = binary_header.unpack_from(payload)
+
+        if msg_type == BINARY_PROCESSING:
+            self.process_frame(str(uuid.UUID(bytes=sess_id)), payload, offset=binary_header.size)
+        else:
+            print('Unknown binary type: {}'.format(msg_type))
+
     def onClose(self, was_clean, code, reason):
         print('WebSocket connection closed {}.'.format(reason))
 
-    def open_session(self, meeting_id):
+        metrics.active_sessions.dec(len(self.sessions))
+        self.sessions = {}
+
+    def open_session(self, meeting_id, match='classifier', replies='frames', reply_format='full'):
         """
         open a meeting session
         :param meeting_id: identity of meeting
+        :param match: how faces are recognized, 'classifier', 'attendants' or 'index'
+        :param replies: replies to the frames, 'frames' or 'attendance', see `Session`
+        :param reply_format: format of the PROCESSED replies, 'full', 'compact' or 'binary', see `Session`
         :return:
         """
-        if meeting_id not in self.sessions:
-            # create a new meeting session
-            sess = Session(meeting_id)
+        if replies not in ('frames', 'attendance'):
+            print('Unknown replies: {}'.format(replies))
+            replies = 'frames'
 
-            # cache current session
-            self.sessions[sess.id] = sess
+        # the format actually used is returned with OPENED
+        if reply_format not in formats:
+            print('Unknown format: {}'.format(reply_format))
+            reply_format = 'full'
 
-        # send to client
-        self.sendMessage(json.dumps({
+        # load the meeting off the reactor thread
+        d = async_storage.run(load_session, meeting_id, match=match)
+        d.addCallbacks(self.session_loaded, self.session_failed, callbackArgs=(meeting_id, replies, reply_format),
+                       errbackArgs=(meeting_id,))
+
+    def session_loaded(self, result, meeting_id, replies='frames', reply_format='full'):
+        attendants, matcher = result
+
+        if self.state != WebSocketServerProtocol.STATE_OPEN:
+            return
+
+        # create a new meeting session
+        sess = Session(meeting_id, attendants, matcher, replies=replies, reply_format=reply_format)
+
+        # cache current session
+        self.sessions[sess.id] = sess
+        metrics.active_sessions.inc()
+
+        reply = {
             'type': 'OPENED',
             'message': 'The session of meeting {} is opened'.format(meeting_id),
-            'session_id': sess.id})
-        )
+            'session_id': sess.id,
+            'format': reply_format
+        }
+
+        if reply_format != 'full':
+            reply['score_scale'] = score_scale
+
+        # send to client
+        self.sendMessage(json.dumps(reply))
+
+    def session_failed(self, failure, meeting_id):
+        print('open session of meeting {} failed: {}'.format(meeting_id, failure.getErrorMessage()))
+
+        if self.state != WebSocketServerProtocol.STATE_OPEN:
+            return
+
+        self.sendMessage(json.dumps({
+            'type': 'OPEN_FAILED',
+            'message': 'Fail to open the session of meeting {}'.format(meeting_id)
+        }))
 
     def close_session(self, sess_id):
         """
@@ -114,22 +234,29 @@ class FaceServerProtocol(WebSocketServerProtocol):
         :param sess_id: session identity of meeting
         :return:
         """
+        reply = {
+            'type': 'CLOSED',
+            'message': 'Session[{}] removed on server'.format(sess_id)
+        }
+
         if sess_id in self.sessions:
-            self.sessions.pop(sess_id)
+            sess = self.sessions.pop(sess_id)
+            metrics.active_sessions.dec()
             print('remove session[{}]'.format(sess_id))
+
+            # attendance of the whole session
+            reply['summary'] = sess.attendance.summary()
         else:
             print('session[{}] not found')
 
-        self.sendMessage(json.dumps({
-            'type': 'CLOSED',
-            'message': 'Session[{}] removed on server'.format(sess_id)
-        }))
+        self.sendMessage(json.dumps(reply))
 
-    def process_frame(self, sess_id, data, save_data=False):
+    def process_frame(self, sess_id, data, offset=None, save_data=False):
         """
-        faces recognition
+        faces recognition, the pipeline runs on the worker pool and the reply is sent when it finishes
         :param sess_id: session identifier
-        :param data: data_url
+        :param data: data_url, or a binary message if offset is given
+        :param offset: offset of the raw JPEG bytes in a binary message
         :param save_data: save data on the disk if true
         :return:
         """
@@ -141,79 +268,203 @@ class FaceServerProtocol(WebSocketServerProtocol):
             return
 
         sess = self.sessions[sess_id]
-        attendants = sess.attendants
+        metrics.frames_received.inc()
+
+        phash = None
+        if sess.cache is not None and not save_data:
+            try:
+                # a thumbnail of the luma only, cheap enough for the reactor thread
+                with metrics.stage('hash'):
+                    phash = frame_hash(data, offset)
+            except (IOError, ValueError, TypeError) as e:
+                # the pipeline reports the broken frame
+                print('Fail to hash frame of session[{}]: {}'.format(sess_id, e))
+
+            if phash is not None:
+                data_detected = sess.cache.get(phash)
+                if data_detected is not None:
+                    self.send_processed(sess, data_detected, cached=True)
+                    metrics.frames_cached.inc()
+                    return
+
+        frame = sess.frames.push((data, offset, save_data, phash))
+        if frame is not None:
+            self.submit_frame(sess, frame, 0)
+
+    def submit_frame(self, sess, frame, coalesced):
+        """
+        Submit a frame of a session to the worker pool
+        :param sess: meeting session
+        :param frame: (data, offset, save_data) arguments of `recognition.recognize`, followed by the hash
+                      of the frame (None if it's not cached)
+        :param coalesced: number of stale frames dropped in favour of this one
+        :return:
+        """
+        sess_id = sess.id
+        submitted = time.time()
+
+        if coalesced > 0:
+            metrics.frames_coalesced.inc(coalesced)
 
-        # data_url head
-        data_url_head = 'data:image/jpeg;base64,'
+        try:
+            d = self.factory.batcher.submit(frame[:3] + (sess.tracker.reusable_locations(), sess.matcher))
+        except WorkerPoolBusy:
+            sess.frames.reset()
+            self.send_busy(sess_id)
+            return
 
-        # deserialize from data_url
-        file_like = StringIO.StringIO(base64.b64decode(data[len(data_url_head):]))
+        d.addCallback(self.frame_processed, sess_id, coalesced, submitted, frame[3])
+        d.addErrback(self.frame_failed, sess_id)
+        d.addBoth(self.frame_finished, sess)
 
-        # convert file_like object to array_like object
-        img = np.asarray(Image.open(file_like)).copy()
+    def send_busy(self, sess_id):
+        print('Worker pool is busy, drop frame of session[{}]'.format(sess_id))
+        metrics.frames_busy.inc()
 
-        if save_data:
-            import os
-            import tempfile
+        if self.state != WebSocketServerProtocol.STATE_OPEN:
+            return
 
-            filename = os.path.join(tempfile.gettempdir(), str(uuid.uuid1()) + ".jpg")
-            io.imsave(filename, img)
+        self.sendMessage(json.dumps({
+            'type': 'BUSY',
+            'session_id': sess_id,
+            'message': 'Server is busy, the frame is dropped'
+        }), isBinary=False)
+
+    def frame_finished(self, _, sess):
+        # process the newest frame arrived in the meantime
+        frame, coalesced = sess.frames.take()
+
+        if frame is not None and sess.id in self.sessions:
+            self.submit_frame(sess, frame, coalesced)
+
+    def frame_processed(self, faces, sess_id, coalesced=0, submitted=None, phash=None):
+        """
+        Send the recognition result of a frame to client
+        :param faces: result of `recognition.recognize`
+        :param sess_id: session identifier
+        :param coalesced: number of stale frames dropped in favour of this one
+        :param submitted: time the frame was submitted to the workers
+        :param phash: perceptual hash of the frame, its result is cached if given
+        :return:
+        """
+        if sess_id not in self.sessions or self.state != WebSocketServerProtocol.STATE_OPEN:
+            # session closed while the frame was being processed
+            return
+
+        sess = self.sessions[sess_id]
+        attendants = sess.attendants
+
+        # fill in the classification of tracked faces
+        faces = sess.tracker.update(faces)
 
         # nos, labels, locations and scores
         attendants_detected = []
 
-        know_face_locations = api.detect_faces(img)
-        if len(know_face_locations) == 0:
+        if len(faces) == 0:
             print 'No face detected in the current frame'
-        else:
-            embeddings = api.face_encodings(img, known_face_locations=know_face_locations)
-
-            predictions = classifier_model.predict_proba(embeddings)
-
-            best_class_indices = np.argmax(predictions, axis=1)
-            best_class_probabilities = predictions[np.arange(len(best_class_indices)), best_class_indices]
-            for i in range(len(best_class_indices)):
-                employee_no = classes[best_class_indices[i]]
 
-                if employee_no == '-1':
-                    # unknown person
+        for face_location, employee_no, score in faces:
+            if employee_no == '-1':
+                # unknown person
+                attendants_detected.append({
+                    'id': -1,
+                    'no': -1,
+                    'name': 'Unknown',
+                    'score': score,
+                    'face_location': face_location,
+                    'is_attendant': False
+                })
+            else:
+                e = employee_directory.get(employee_no)
+                print '%s %s: %.3f' % (employee_no, 'No name' if e is None else e['fullname'], score)
+
+                if e is None:
+                    print 'Employee `{}` not found'.format(employee_no)
+                    continue
+                else:
                     attendants_detected.append({
-                        'id': -1,
-                        'no': -1,
-                        'name': 'Unknown',
-                        'score': best_class_probabilities[i],
-                        'face_location': know_face_locations[i],
-                        'is_attendant': False
+                        'id': e['id'],
+                        'no': employee_no,
+                        'name': e['fullname'],
+                        'english_name': e['english_name'],
+                        'score': score,
+                        'face_location': face_location,
+                        'is_attendant': e['id'] in attendants
                     })
-                else:
-                    label = all_employees.get(employee_no, 'No name')
-                    print '%s %s: %.3f' % (employee_no, label, best_class_probabilities[i])
-
-                    e = all_employees.get(employee_no)
-                    if e is None:
-                        print 'Employee `{}` not found'.format(employee_no)
-                        continue
-                    else:
-                        attendants_detected.append({
-                            'id': e['id'],
-                            'no': employee_no,
-                            'name': e['fullname'],
-                            'english_name': e['english_name'],
-                            'score': best_class_probabilities[i],
-                            'face_location': know_face_locations[i],
-                            'is_attendant': e['id'] in attendants
-                        })
-
-        # send the reply to client
-        self.sendMessage(json.dumps({
-            'type': 'PROCESSED',
-            'data': attendants_detected
-        }), isBinary=False)
+
+        if phash is not None and sess.cache is not None:
+            sess.cache.put(phash, attendants_detected)
+
+        self.send_processed(sess, attendants_detected, coalesced)
+
+        metrics.frames_processed.inc()
+        metrics.frames_per_second.mark()
+
+        if submitted is not None:
+            metrics.frame_seconds.observe(time.time() - submitted)
+
+    def send_processed(self, sess, attendants_detected, coalesced=0, cached=False):
+        """
+        Send the PROCESSED reply of a frame to client, and the ATTENDANCE reply if the attendance changed
+        :param sess: meeting session
+        :param attendants_detected: faces of the frame
+        :param coalesced: number of stale frames dropped in favour of this one
+        :param cached: the faces are the result of a near-duplicate frame
+        """
+        changes = sess.attendance.observe(attendants_detected)
+
+        with metrics.stage('send'):
+            if sess.replies == 'frames' and sess.encoder is not None:
+                self.send_compact(sess, attendants_detected, coalesced, cached)
+            elif sess.replies == 'frames':
+                self.sendMessage(json.dumps({
+                    'type': 'PROCESSED',
+                    'data': attendants_detected,
+                    'coalesced': coalesced,
+                    'cached': cached
+                }), isBinary=False)
+
+            if changes:
+                self.sendMessage(json.dumps({
+                    'type': 'ATTENDANCE',
+                    'session_id': sess.id,
+                    'changes': changes,
+                    'present': sess.attendance.present()
+                }), isBinary=False)
+
+    def send_compact(self, sess, attendants_detected, coalesced=0, cached=False):
+        """
+        Send the PROCESSED reply of a frame in the compact format of the session, preceded by the metadata
+        of the employees seen for the first time
+        """
+        employees, rows = sess.encoder.encode(attendants_detected)
+
+        if employees:
+            self.sendMessage(employees_message(sess.id, employees), isBinary=False)
+
+        if sess.reply_format == 'binary':
+            self.sendMessage(sess.encoder.to_binary(rows, sess.id, coalesced, cached), isBinary=True)
+        else:
+            self.sendMessage(sess.encoder.to_json(rows, sess.id, coalesced, cached), isBinary=False)
+
+    def frame_failed(self, failure, sess_id):
+        if failure.check(WorkerPoolBusy):
+            self.send_busy(sess_id)
+            return
+
+        metrics.frames_failed.inc()
+        print('process frame of session[{}] failed: {}'.format(sess_id, failure.getErrorMessage()))
 
 
 class FaceServerFactory(WebSocketServerFactory):
     protocol = FaceServerProtocol
 
+    # recognition workers
+    pool = None
+
+    # gathers frames of all sessions into batches for the workers
+    batcher = None
+
 
 @click.command()
 @click.option('--iface', default='127.0.0.1',
@@ -225,25 +476,105 @@ class FaceServerFactory(WebSocketServerFactory):
 @click.option('--enable-ssl/--disable-ssl', default=False)
 @click.option('--ssl-key', default=None)
 @click.option('--ssl-crt', default=None)
-def main(iface, port, web_port, web_dir, enable_ssl, ssl_key, ssl_crt):
+@click.option('--pool-type', type=click.Choice(['thread', 'process']), default='thread',
+              help='Run faces recognition on worker threads or processes. Default is \'thread\'')
+@click.option('--pool-size', default=4, help='Number of recognition workers. Default is 4')
+@click.option('--pool-queue', default=16,
+              help='Max number of jobs waiting for a free worker before replying BUSY. Default is 16')
+@click.option('--pool-timeout', default=30,
+              help='Seconds after which a job of a worker process fails without result, e.g. if the process died. '
+                   'Default is 30')
+@click.option('--batch-window', default=0,
+              help='Milliseconds to gather frames of all sessions into one batch, e.g. 10-20. Default is 0 (no batching)')
+@click.option('--batch-size', default=16, help='Max number of frames in a batch. Default is 16')
+@click.option('--employee-index/--no-employee-index', default=False,
+              help='Build the index of all employee encodings at startup instead of on the first \'index\' session')
+@click.option('--snapshot', default=default_snapshot_path,
+              help='Employee snapshot written by `snapshot.py write`, only employees added after it are loaded '
+                   'from the database')
+@click.option('--enroll-workers', default=web_enroll_workers,
+              help='Number of processes encoding avatars of bulk enrollments, in each server process. '
+                   '0 is the number of cores. Default is [web] enroll_workers')
+@click.option('--workers', default=1,
+              help='Number of server processes sharing the ports, each one runs its own reactor and workers. '
+                   'Default is 1')
+def main(iface, port, web_port, web_dir, enable_ssl, ssl_key, ssl_crt, pool_type, pool_size, pool_queue,
+         pool_timeout, batch_window, batch_size, employee_index, snapshot, enroll_workers, workers):
 
     from twisted.python import log
 
     # start logging
     log.startLogging(sys.stdout)
 
+    use_snapshot(snapshot)
+
+    # load all employees info [ employee_no, employee_fullname ]
+    employee_directory.load()
+    print 'There are %d employees in total' % len(employee_directory)
+
+    if employee_index:
+        # build before worker processes are forked, so that they share it
+        get_employee_index()
+
+    if classifier_type == 'centroid':
+        centroid.get_centroid_model()
+
+    sockets = None
+
+    if workers > 1:
+        if not has_reuseport:
+            # without SO_REUSEPORT, the workers accept connections on the sockets of the parent
+            sockets = reuseport_socket('', port), reuseport_socket('', web_port)
+
+        # models, snapshot, directory and index loaded above are shared copy-on-write by the workers
+        worker = fork_workers(workers)
+        if worker is None:
+            return
+
+        print('Worker {} running in process {}'.format(worker, os.getpid()))
+
+        # connections opened while loading must not be shared with the other workers
+        storage.dispose()
+
+        if sockets is None:
+            sockets = reuseport_socket('', port), reuseport_socket('', web_port)
+
+    # forked before any thread is started, see `create_enroll_pool`
+    enroll_pool, enroll_workers = create_enroll_pool(enroll_workers)
+
     # choose the "best" available Twisted reactor
     from autobahn.twisted.choosereactor import install_reactor
 
     reactor = install_reactor()
     print("Running reactor on {}".format(reactor))
 
+    reactor.addSystemEventTrigger('before', 'shutdown', enroll_pool.terminate)
+
+    # pick up new employees without restarting
+    employee_directory.start()
+
+    # start recognition workers
+    pool = WorkerPool(pool_type, pool_size, pool_queue, initializer=init_worker, timeout=pool_timeout)
+    pool.start(reactor)
+    metrics.queue_depth.fn = lambda: pool.pending
+
+    if classifier_type == 'centroid':
+        # after the pool is started, so that its processes reload the checkpoints instead of owning the model.
+        # Every server process polls the new employees, only the first one writes the checkpoints
+        centroid.start(checkpoint_interval=centroid.centroid_checkpoint_interval
+                       if workers <= 1 or worker == 0 else 0)
+
+    # same for the employee index, whether it's built now or by the first 'index' session
+    ann.start(checkpoint_interval=ann.index_checkpoint_interval if workers <= 1 or worker == 0 else 0)
+
+    batcher = Batcher(pool, recognize_batch, batch_window / 1000.0, batch_size)
+
     # get web site
-    site = get_site(web_dir)
+    site = get_site(enroll_pool, enroll_workers, web_dir)
 
-    if enable_ssl:
-        import os
+    ssl_factory = None
 
+    if enable_ssl:
         if ssl_key is None or not os.path.exists(ssl_key):
             raise Exception("ssl key file not found: {}" % ssl_key)
 
@@ -253,10 +584,26 @@ def main(iface, port, web_port, web_dir, enable_ssl, ssl_key, ssl_crt):
         # construct ssl context factory
         ssl_factory = ssl.DefaultOpenSSLContextFactory(ssl_key, ssl_crt)
 
-        # construct web factory
-        ws_factory = FaceServerFactory("wss://{}:{}".format(iface, port))
-        ws_factory.setProtocolOptions(allowedOrigins="*")
+    # construct web socket factory
+    ws_factory = FaceServerFactory("{}://{}:{}".format('wss' if enable_ssl else 'ws', iface, port))
+    ws_factory.setProtocolOptions(allowedOrigins="*")
+    ws_factory.pool = pool
+    ws_factory.batcher = batcher
+
+    if sockets is not None:
+        ws_socket, web_socket = sockets
+
+        if enable_ssl:
+            from twisted.protocols.tls import TLSMemoryBIOFactory
 
+            adopt_port(reactor, ws_socket, TLSMemoryBIOFactory(ssl_factory, False, ws_factory))
+            adopt_port(reactor, web_socket, TLSMemoryBIOFactory(ssl_factory, False, site))
+        else:
+            adopt_port(reactor, ws_socket, ws_factory)
+            adopt_port(reactor, web_socket, site)
+
+        print('Web server listen on {}: {}'.format(web_port, web_dir))
+    elif enable_ssl:
         # listen on ssl connection
         listenWS(ws_factory, ssl_factory)
 
@@ -264,10 +611,6 @@ def main(iface, port, web_port, web_dir, enable_ssl, ssl_key, ssl_crt):
         reactor.listenSSL(web_port, site, ssl_factory)
         print('Secure web server listen on {}: {}'.format(web_port, web_dir))
     else:
-        # start a WebSocket server
-        ws_factory = FaceServerFactory("ws://{}:{}".format(iface, port))
-        ws_factory.setProtocolOptions(allowedOrigins="*")
-
         # listen on port when tcp client connection coming
         reactor.listenTCP(port, ws_factory)
 
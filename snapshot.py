@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import struct
+import sys
+import time
+import click
+import numpy as np
+import conf
+
+# header of a snapshot file: magic, format version, number of employees, encoding dimension,
+# creation time, max employee id, offset and length of the json metadata.
+# The float32 encoding matrix starts right after the header, so that it can be memory-mapped.
+snapshot_header = struct.Struct('<8sIIIdqqq76x')
+snapshot_magic = 'FGSNAP\x00\x01'
+snapshot_version = 1
+
+default_snapshot_path = conf.get_prop('snapshot', 'path', '')
+default_changes_path = conf.get_prop('snapshot', 'changes_path', 'employees.changes')
+
+
+def record_change(employee_id, path=default_changes_path):
+    """
+    Append the id of an employee whose face encoding changed to the journal of changes, so that a snapshot
+    or a checkpoint written before the change is corrected when it's loaded. Lines are appended in one
+    write, every server process can record changes.
+    :param path: journal file, empty to record nothing
+    """
+    if not path:
+        return
+
+    with open(path, 'a') as f:
+        f.write('{} {!r}\n'.format(employee_id, time.time()))
+
+
+def read_changes(since, path=default_changes_path):
+    """
+    :param since: time the snapshot or checkpoint started to read the employees
+    :return: ids of the employees whose face encoding changed since then
+    :rtype: set
+    """
+    changed = set()
+
+    if not path or not os.path.exists(path):
+        return changed
+
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2 and float(parts[1]) >= since:
+                changed.add(int(parts[0]))
+
+    return changed
+
+
+def load_changes(storage, since, max_employee_id):
+    """
+    Load the face encodings changed since a snapshot or a checkpoint, of the employees it contains
+    (the employees added after it are loaded by id)
+    :return: face encodings, like `Storage.load_all_employee_reps`
+    """
+    return storage.load_employee_reps([eid for eid in read_changes(since) if eid <= max_employee_id])
+
+
+class Snapshot(object):
+
+    def __init__(self, path):
+        """
+        Read-only memory-mapped snapshot of all employees and their face encodings
+        :param path: snapshot file
+        """
+        with open(path, 'rb') as f:
+            magic, version, count, dim, created, max_employee_id, meta_offset, meta_length = \
+                snapshot_header.unpack(f.read(snapshot_header.size))
+
+            if magic != snapshot_magic or version != snapshot_version:
+                raise ValueError('Not a version {} snapshot: {}'.format(snapshot_version, path))
+
+            f.seek(meta_offset)
+            meta = json.loads(f.read(meta_length))
+
+        self.path = path
+
+        # time the employees were read, the changes recorded since then are not in the snapshot
+        self.created = created
+        self.max_employee_id = max_employee_id
+
+        self.ids = meta['ids']
+        self.nos = meta['nos']
+        self.names = meta['names']
+        self.english_names = meta['english_names']
+
+        # employees without face encodings are not in the matrix
+        self.reps_rows = meta['reps_rows']
+
+        # pages are shared by all processes mapping the file
+        self.encodings = np.memmap(path, dtype='<f4', mode='r', offset=snapshot_header.size, shape=(count, dim)) \
+            if count > 0 else np.empty((0, dim), dtype=np.float32)
+
+    def employees(self):
+        """
+        :return: employees by employee no, like `Storage.load_all_employees`
+        """
+        return dict((no, {'id': eid, 'fullname': name, 'english_name': english_name})
+                    for eid, no, name, english_name in zip(self.ids, self.nos, self.names, self.english_names))
+
+    def employee_reps(self):
+        """
+        :return: face encodings of all employees, like `Storage.load_all_employee_reps`.
+                 See `delta_reps` for the encodings changed or added after the snapshot
+        """
+        return [self.ids[i] for i in self.reps_rows], [self.nos[i] for i in self.reps_rows], self.encodings
+
+    def delta_reps(self, storage):
+        """
+        :return: (changed, added) face encodings: of the employees of the snapshot whose encoding changed
+                 after it, and of the employees added after it
+        """
+        return load_changes(storage, self.created, self.max_employee_id), \
+            storage.load_all_employee_reps(self.max_employee_id)
+
+
+def write_snapshot(path, storage):
+    """
+    Write all employees and their face encodings to a snapshot file
+    :param path: snapshot file, replaced atomically
+    :param storage: storage to read employees from
+    """
+    # changes recorded from now on may be missed by the queries, they are applied when the snapshot is used
+    created = time.time()
+
+    employees = storage.load_all_employees()
+    reps_ids, _, encodings = storage.load_all_employee_reps()
+
+    items = sorted(employees.iteritems(), key=lambda item: item[1]['id'])
+    ids = [e['id'] for _, e in items]
+
+    # skip encodings of employees added between the two queries, they are picked up as deltas
+    row_of = dict((eid, i) for i, eid in enumerate(ids))
+    keep = [i for i, eid in enumerate(reps_ids) if eid in row_of]
+
+    reps_rows = [row_of[reps_ids[i]] for i in keep]
+    encodings = encodings[keep]
+
+    meta = json.dumps({
+        'ids': ids,
+        'nos': [no for no, _ in items],
+        'names': [e['fullname'] for _, e in items],
+        'english_names': [e['english_name'] for _, e in items],
+        'reps_rows': reps_rows
+    })
+
+    encodings = np.ascontiguousarray(encodings, dtype='<f4')
+    count, dim = encodings.shape if len(encodings) > 0 else (0, 128)
+    meta_offset = snapshot_header.size + encodings.nbytes
+
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(snapshot_header.pack(snapshot_magic, snapshot_version, count, dim, created,
+                                     max(ids or [0]), meta_offset, len(meta)))
+        f.write(encodings.tostring())
+        f.write(meta)
+
+    os.rename(temp, path)
+
+    return len(ids), count
+
+
+# snapshot used at startup, set by `use_snapshot`
+current = None
+
+
+def use_snapshot(path=default_snapshot_path):
+    """
+    Map a snapshot file, employees and encodings are then loaded from it plus the DB rows added after it
+    :return: the snapshot, or None if there is no snapshot file
+    """
+    global current
+
+    if not path or not os.path.exists(path):
+        return None
+
+    current = Snapshot(path)
+    print('Mapped snapshot "{}" of {} employees, max employee id {}'
+          .format(path, len(current.ids), current.max_employee_id))
+
+    return current
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--output', default=default_snapshot_path or 'employees.snap', help='Snapshot file')
+def write(output):
+    """
+    Write a snapshot of all employees and their face encodings
+    """
+    from db import storage
+
+    employees, encodings = write_snapshot(output, storage)
+    print('Wrote snapshot "{}" of {} employees, {} encodings'.format(output, employees, encodings))
+
+
+@cli.command()
+@click.argument('path', default=default_snapshot_path or 'employees.snap')
+def info(path):
+    """
+    Print the content summary of a snapshot
+    """
+    snap = Snapshot(path)
+    print('employees: {}, encodings: {}, max employee id: {}, created: {}'.format(
+        len(snap.ids), len(snap.encodings), snap.max_employee_id, time.ctime(snap.created)))
+
+
+if __name__ == '__main__':
+    cli(sys.argv[1:])
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests of the modules which don't need dlib, run from the project directory:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules import each other as top-level modules and read conf.ini at import time
+sys.path.insert(0, root)
+os.environ.setdefault('FACEGO_CONF', os.path.join(root, 'conf.ini'))
+
+
+def employee_row(no, encoding):
+    """
+    :return: an employee of `Storage.bulk_new_employees`
+    """
+    from db import encode_reps
+
+    return {
+        'employee_no': no, 'firstname': 'First', 'lastname': no, 'engname': 'Eng ' + no, 'title': '', 'group': '',
+        'gender': 0, 'email': '', 'avatar': '', 'reps': encode_reps(encoding)
+    }
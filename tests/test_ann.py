@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import ann
+
+from ann import EmployeeIndex, IndexMatcher
+
+
+def _brute_force(encodings, labels, queries):
+    d = np.linalg.norm(queries[:, np.newaxis] - encodings, axis=2)
+    return [labels[i] for i in np.argmin(d, axis=1)]
+
+
+class EmployeeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.encodings = rng.normal(0, 0.1, (300, 128)).astype(np.float32)
+        self.ids = range(1, 301)
+        self.nos = ['e{}'.format(i) for i in self.ids]
+
+    def test_brute_force(self):
+        index = EmployeeIndex(brute_force_threshold=1000)
+        index.build(self.ids, self.nos, self.encodings)
+
+        self.assertEqual(len(index), 300)
+        self.assertIsNone(index.centroids)
+
+        results = index.search(self.encodings[:10] + 0.001)
+        self.assertEqual([no for no, _ in results], self.nos[:10])
+        self.assertLess(results[0][1], 0.05)
+
+    def test_inverted_file(self):
+        index = EmployeeIndex(brute_force_threshold=100, nlist=8, nprobe=8)
+        index.build(self.ids, self.nos, self.encodings)
+
+        self.assertEqual(len(index.centroids), 8)
+
+        # probing every partition is exact
+        queries = self.encodings[::7] + 0.01
+        self.assertEqual([no for no, _ in index.search(queries)],
+                         _brute_force(self.encodings, self.nos, queries))
+
+    def test_add_and_update(self):
+        index = EmployeeIndex(brute_force_threshold=100, nlist=4, nprobe=4, compact_fraction=1.0)
+        index.build(self.ids, self.nos, self.encodings)
+
+        new = np.full(128, 0.3, dtype=np.float32)
+        index.add(1000, 'new', new)
+        self.assertEqual(index.search([new])[0][0], 'new')
+
+        # the replaced encoding is not found anymore
+        index.update(1, new + 0.5)
+        self.assertEqual(index.search([new + 0.5])[0][0], self.nos[0])
+        self.assertNotEqual(index.search(self.encodings[:1])[0][0], self.nos[0])
+        self.assertEqual(index.deleted_count, 1)
+
+        # unknown employees are ignored by update
+        index.update(5000, new)
+        self.assertEqual(len(index), 301)
+
+    def test_compact(self):
+        index = EmployeeIndex(brute_force_threshold=100, nlist=4, nprobe=4, compact_fraction=0.25)
+        index.build(self.ids, self.nos, self.encodings)
+
+        rng = np.random.RandomState(1)
+        replaced = rng.normal(0, 0.1, (150, 128)).astype(np.float32)
+        for employee_id, encoding in zip(self.ids[:150], replaced):
+            index.update(employee_id, encoding)
+
+        # compacted once the replaced rows were over a quarter of the rows
+        self.assertLess(index.deleted_count, 150)
+        self.assertLess(len(index.labels), 450)
+        self.assertEqual(len(index), 300)
+
+        current = np.vstack([replaced, self.encodings[150:]])
+        queries = current[::5] + 0.001
+        self.assertEqual([no for no, _ in index.search(queries)], _brute_force(current, self.nos, queries))
+
+    def test_matcher(self):
+        index = EmployeeIndex()
+        index.build(self.ids[:3], self.nos[:3], self.encodings[:3])
+        matcher = IndexMatcher(index, tolerance=0.6)
+
+        results = matcher.match(np.vstack([self.encodings[2], np.full(128, 1.0)]))
+        self.assertEqual([no for no, _ in results], [self.nos[2], '-1'])
+
+        self.assertEqual(IndexMatcher(EmployeeIndex()).match(self.encodings[:1]), [('-1', 0.0)])
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'employee_index.npz')
+
+        rng = np.random.RandomState(0)
+        self.encodings = rng.normal(0, 0.1, (200, 128)).astype(np.float32)
+        self.ids = range(1, 201)
+        self.nos = ['e{}'.format(i) for i in self.ids]
+
+        self.index = EmployeeIndex(brute_force_threshold=100, nlist=4, nprobe=4)
+        self.index.build(self.ids, self.nos, self.encodings)
+
+        self._globals = ann.employee_index, ann.index_checkpoint, ann._checkpoint_mtime, ann._checked
+
+    def tearDown(self):
+        ann.employee_index, ann.index_checkpoint, ann._checkpoint_mtime, ann._checked = self._globals
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        new = np.full(128, 0.3, dtype=np.float32)
+        self.index.add(500, 'new', new)
+        self.index.update(1, new + 0.5)
+
+        self.assertEqual(self.index.save(self.path), self.index.version)
+
+        loaded = EmployeeIndex.load(self.path)
+        self.assertEqual(len(loaded), 201)
+        self.assertEqual(loaded.max_employee_id, 500)
+        self.assertIsNotNone(loaded.created)
+
+        # the partitions are kept, only the replaced encodings are dropped
+        np.testing.assert_array_equal(loaded.centroids, self.index.centroids)
+        self.assertEqual(len(loaded.labels), 201)
+
+        queries = np.vstack([self.encodings[::9], new[np.newaxis], new[np.newaxis] + 0.5])
+        self.assertEqual(loaded.search(queries), self.index.search(queries))
+
+    def test_brute_force_round_trip(self):
+        index = EmployeeIndex()
+        index.build(self.ids[:3], self.nos[:3], self.encodings[:3])
+        index.save(self.path)
+
+        loaded = EmployeeIndex.load(self.path)
+        self.assertIsNone(loaded.centroids)
+        self.assertEqual(loaded.search(self.encodings[:3]), index.search(self.encodings[:3]))
+
+        EmployeeIndex().save(self.path)
+        self.assertEqual(len(EmployeeIndex.load(self.path)), 0)
+
+    def test_worker_reload(self):
+        # a worker process built its index before the server process added an employee
+        ann.employee_index = EmployeeIndex()
+        ann.employee_index.build(self.ids, self.nos, self.encodings)
+
+        new = np.full(128, 0.3, dtype=np.float32)
+        self.index.add(500, 'new', new)
+        self.index.save(self.path)
+
+        ann.index_checkpoint, ann._checkpoint_mtime, ann._checked = self.path, None, 0
+
+        self.assertEqual(IndexMatcher(ann.get_employee_index()).match([new])[0][0], 'new')
+
+    def test_init_worker(self):
+        # the index is not built until a job needs it
+        ann.employee_index = None
+        ann.init_worker()
+
+        self.assertIsNone(ann.employee_index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from attendance import Attendance
+
+
+def face(employee_id, no, score=0.8):
+    return {'id': employee_id, 'no': no, 'name': 'Name ' + no, 'english_name': None, 'is_attendant': True,
+            'score': score}
+
+
+unknown = {'id': -1, 'no': '-1', 'name': '', 'is_attendant': False, 'score': 0.0}
+
+
+class AttendanceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.attendance = Attendance([1, 2, 3], window=4, arrive_count=2, leave_count=0)
+
+    def test_arrive_and_leave(self):
+        self.assertEqual(self.attendance.observe([face(1, 'a'), unknown], now=1), [])
+
+        changes = self.attendance.observe([face(1, 'a', 0.6)], now=2)
+        self.assertEqual([(c['no'], c['state']) for c in changes], [('a', 'arrived')])
+        self.assertAlmostEqual(changes[0]['confidence'], 0.7, places=5)
+        self.assertEqual(self.attendance.present(), ['a'])
+
+        # still present while detected in the window
+        for now in range(3, 6):
+            self.assertEqual(self.attendance.observe([], now=now), [])
+
+        changes = self.attendance.observe([], now=6)
+        self.assertEqual([(c['no'], c['state']) for c in changes], [('a', 'left')])
+        self.assertEqual(self.attendance.present(), [])
+
+    def test_single_frame_ignored(self):
+        self.attendance.observe([face(1, 'a')], now=1)
+        for now in range(2, 10):
+            self.attendance.observe([], now=now)
+
+        self.assertEqual(self.attendance.present(), [])
+        self.assertEqual(self.attendance.summary()['employees'], [])
+
+    def test_best_face_of_a_frame(self):
+        self.attendance.observe([face(1, 'a', 0.5), face(1, 'a', 0.9)], now=1)
+        self.attendance.observe([face(1, 'a', 0.7)], now=2)
+
+        p = self.attendance.employees['a']
+        self.assertEqual(p.detections, 2)
+        self.assertAlmostEqual(p.score_sum, 1.6, places=5)
+
+    def test_summary(self):
+        for now in range(1, 4):
+            self.attendance.observe([face(2, 'b'), face(4, 'd', 0.6)], now=now)
+
+        summary = self.attendance.summary()
+        self.assertEqual(summary['frames'], 3)
+        self.assertEqual(sorted(e['no'] for e in summary['employees']), ['b', 'd'])
+        self.assertEqual(summary['absent_attendants'], [1, 3])
+
+        d = [e for e in summary['employees'] if e['no'] == 'd'][0]
+        self.assertEqual((d['first_seen'], d['last_seen'], d['detections'], d['arrivals']), (1, 3, 3, 1))
+        self.assertAlmostEqual(d['confidence'], 0.6, places=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from centroid import CentroidModel
+
+
+class CentroidModelTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.encodings = rng.normal(0, 0.1, (4, 128))
+        self.model = CentroidModel(tolerance=0.6)
+        self.model.build([1, 2, 3, 4], ['a', 'b', 'c', 'd'], self.encodings)
+
+    def test_build(self):
+        self.assertEqual(len(self.model), 4)
+        self.assertEqual(self.model.max_employee_id, 4)
+        self.assertIn(3, self.model)
+        self.assertNotIn(5, self.model)
+
+        self.assertEqual([no for no, _ in self.model.predict(self.encodings[::-1])], ['d', 'c', 'b', 'a'])
+
+    def test_predict_unknown(self):
+        results = self.model.predict(np.full((1, 128), 1.0))
+
+        self.assertEqual(results[0][0], '-1')
+        self.assertEqual(self.model.predict([]), [])
+        self.assertEqual(CentroidModel().predict(self.encodings[:2]), [('-1', 0.0)] * 2)
+
+    def test_add(self):
+        new = np.full(128, 0.2)
+        self.model.add(10, 'x', new)
+
+        self.assertEqual(len(self.model), 5)
+        self.assertEqual(self.model.max_employee_id, 10)
+        self.assertEqual(self.model.predict([new])[0][0], 'x')
+
+        # another sample of a known employee moves its centroid to the mean
+        self.model.add(10, 'x', new + 0.2)
+        self.assertEqual(len(self.model), 5)
+
+        no, score = self.model.predict([new + 0.1])[0]
+        self.assertEqual(no, 'x')
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+    def test_add_grows(self):
+        rng = np.random.RandomState(1)
+        for employee_id in range(10, 210):
+            self.model.add(employee_id, str(employee_id), rng.normal(0, 0.1, 128))
+
+        self.assertEqual(len(self.model), 204)
+        self.assertEqual(self.model.predict(self.encodings[:1])[0][0], 'a')
+
+    def test_update(self):
+        new = np.full(128, 0.2)
+        self.model.add(2, 'b', self.encodings[0])
+        self.model.update(2, new)
+
+        self.assertEqual(self.model.predict([new])[0], ('b', 1.0))
+        self.assertEqual(self.model.predict(self.encodings[:1])[0][0], 'a')
+
+        # unknown employees are ignored
+        version = self.model.version
+        self.model.update(99, new)
+        self.assertEqual(self.model.version, version)
+        self.assertNotIn(99, self.model)
+
+    def test_published_state_unchanged(self):
+        labels, centroids, _ = self.model._state
+        before = centroids.copy()
+
+        self.model.update(1, np.full(128, 0.2))
+        self.model.add(5, 'e', np.full(128, 0.3))
+
+        # a reader of the previous state is not disturbed
+        np.testing.assert_array_equal(centroids, before)
+        self.assertEqual(len(centroids), 4)
+
+    def test_checkpoint_round_trip(self):
+        self.model.add(2, 'b', self.encodings[0])
+        self.model.add(7, 'g', np.full(128, 0.2))
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'centroid.npz')
+            version = self.model.save(path)
+            self.assertEqual(version, self.model.version)
+
+            loaded = CentroidModel.load(path, tolerance=0.6)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(len(loaded), len(self.model))
+        self.assertEqual(loaded.max_employee_id, 7)
+        self.assertIsNotNone(loaded.created)
+
+        queries = np.vstack([self.encodings, np.full((1, 128), 0.2), np.full((1, 128), 1.0)])
+        self.assertEqual(loaded.predict(queries), self.model.predict(queries))
+
+        # the number of samples is kept, the next sample is averaged in the same way
+        loaded.add(2, 'b', self.encodings[1])
+        self.model.add(2, 'b', self.encodings[1])
+        self.assertEqual(loaded.predict(queries), self.model.predict(queries))
+
+
+if __name__ == '__main__':
+    unittest.main()
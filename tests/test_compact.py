@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+import uuid
+
+from compact import BINARY_PROCESSED, FLAG_CACHED, CompactEncoder, employees_message, processed_face, \
+    processed_header, quantize_score
+
+
+def face(employee_id, no, location, score=0.8):
+    return {'id': employee_id, 'no': no, 'name': 'Name ' + no, 'english_name': 'English ' + no, 'is_attendant': True,
+            'score': score, 'face_location': location}
+
+
+def unknown(location):
+    return {'id': -1, 'no': '-1', 'score': 0.1, 'face_location': location}
+
+
+class CompactEncoderTest(unittest.TestCase):
+
+    def test_quantize_score(self):
+        self.assertEqual([quantize_score(s) for s in (-1, 0, 0.5, 1, 2)], [0, 0, 128, 255, 255])
+
+    def test_refs_sent_once(self):
+        encoder = CompactEncoder()
+
+        employees, rows = encoder.encode([face(7, 'a', (10, 20, 30, 40)), unknown((0, 0, 5, 5))])
+        self.assertEqual([(e['ref'], e['id'], e['no']) for e in employees], [(0, 7, 'a')])
+        self.assertEqual(rows, [[0, 204, 10, 20, 30, 40], [-1, 26, 0, 0, 5, 5]])
+
+        employees, rows = encoder.encode([face(8, 'b', (0, 0, 1, 1)), face(7, 'a', (12, 21, 32, 41))])
+        self.assertEqual([e['no'] for e in employees], ['b'])
+
+        # the box of a ref seen once in the previous reply is a delta
+        self.assertEqual(rows, [[1, 204, 0, 0, 1, 1], [0, 204, 2, 1, 2, 1]])
+
+    def test_absolute_boxes(self):
+        encoder = CompactEncoder()
+        encoder.encode([face(7, 'a', (10, 20, 30, 40)), face(7, 'a', (50, 20, 70, 40))])
+
+        # the ref had two faces in the previous reply
+        _, rows = encoder.encode([face(7, 'a', (11, 20, 31, 40))])
+        self.assertEqual(rows, [[0, 204, 11, 20, 31, 40]])
+
+        # and it's missing from the previous reply
+        encoder.encode([])
+        _, rows = encoder.encode([face(7, 'a', (12, 20, 32, 40))])
+        self.assertEqual(rows, [[0, 204, 12, 20, 32, 40]])
+
+    def test_to_json(self):
+        sess_id = str(uuid.uuid1())
+
+        self.assertEqual(json.loads(CompactEncoder.to_json([[0, 1, 2, 3, 4, 5]], sess_id)),
+                         {'type': 'PROCESSED', 'session_id': sess_id, 'f': [[0, 1, 2, 3, 4, 5]]})
+        self.assertEqual(json.loads(CompactEncoder.to_json([], sess_id, coalesced=2, cached=True)),
+                         {'type': 'PROCESSED', 'session_id': sess_id, 'f': [], 'c': 2, 'k': 1})
+
+    def test_to_binary(self):
+        sess_id = uuid.uuid1()
+        rows = [[0, 204, 10, 20, 30, 40], [-1, 26, -1, -2, 3, 4]]
+        data = CompactEncoder.to_binary(rows, str(sess_id), coalesced=300, cached=True)
+
+        self.assertEqual(len(data), processed_header.size + 2 * processed_face.size)
+        self.assertEqual(processed_header.unpack_from(data), (BINARY_PROCESSED, sess_id.bytes, FLAG_CACHED, 255, 2))
+        self.assertEqual([list(processed_face.unpack_from(data, processed_header.size + i * processed_face.size))
+                          for i in range(2)], rows)
+
+    def test_employees_message(self):
+        self.assertEqual(json.loads(employees_message('s1', [{'ref': 0}])),
+                         {'type': 'EMPLOYEES', 'session_id': 's1', 'data': [{'ref': 0}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
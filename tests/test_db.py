@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import cStringIO as StringIO
+import unittest
+import numpy as np
+
+from db import SQLiteStorage, decode_reps, decode_reps_bulk, encode_reps, reps_header
+from tests import employee_row
+
+
+def _npy_reps(encoding):
+    f = StringIO.StringIO()
+    np.save(f, encoding)
+    return f.getvalue()
+
+
+class RepsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.encoding = np.random.RandomState(0).normal(0, 0.1, 128)
+
+    def test_round_trip(self):
+        blob = encode_reps(self.encoding)
+
+        self.assertEqual(len(blob), reps_header.size + 128 * 4)
+
+        decoded = decode_reps(blob)
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_array_equal(decoded, self.encoding.astype(np.float32))
+
+    def test_legacy_npy(self):
+        np.testing.assert_array_equal(decode_reps(_npy_reps(self.encoding)), self.encoding)
+
+    def test_bulk(self):
+        encodings = np.random.RandomState(1).normal(0, 0.1, (3, 128))
+        blobs = [encode_reps(encodings[0]), _npy_reps(encodings[1]), encode_reps(encodings[2])]
+
+        decoded = decode_reps_bulk(blobs)
+        self.assertEqual(decoded.shape, (3, 128))
+        np.testing.assert_array_equal(decoded, encodings.astype(np.float32))
+
+        self.assertEqual(decode_reps_bulk([]).shape, (0, 128))
+
+
+
+
+class SQLiteStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = SQLiteStorage()
+        self.encodings = np.random.RandomState(0).normal(0, 0.1, (3, 128)).astype(np.float32)
+        self.ids = self.storage.bulk_new_employees([employee_row(no, encoding)
+                                                    for no, encoding in zip(['a', 'b', 'c'], self.encodings)])
+
+    def test_bulk_new_employees(self):
+        self.assertEqual(sorted(self.ids), ['a', 'b', 'c'])
+
+        # existing nos are skipped
+        ids = self.storage.bulk_new_employees([employee_row('a', self.encodings[0]),
+                                               employee_row('d', self.encodings[1])])
+        self.assertIsNone(ids['a'])
+        self.assertIsNotNone(ids['d'])
+
+    def test_load_employee_reps(self):
+        ids, nos, encodings = self.storage.load_all_employee_reps()
+        self.assertEqual(sorted(nos), ['a', 'b', 'c'])
+
+        ids, nos, encodings = self.storage.load_all_employee_reps(since_id=self.ids['a'])
+        self.assertEqual(sorted(nos), ['b', 'c'])
+
+        ids, nos, encodings = self.storage.load_employee_reps([self.ids['b']])
+        self.assertEqual((ids, nos), ([self.ids['b']], ['b']))
+        np.testing.assert_array_equal(encodings, self.encodings[1:2])
+
+        self.assertEqual(self.storage.load_employee_reps([])[2].shape, (0, 128))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+
+import directory
+
+from twisted.internet import defer
+
+from db import SQLiteStorage
+from directory import EmployeeDirectory
+from tests import employee_row
+
+
+class SyncStorage(object):
+    """
+    Async storage running the queries right away
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __getattr__(self, name):
+        return lambda *args: defer.succeed(getattr(self.storage, name)(*args))
+
+
+class EmployeeDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = SQLiteStorage()
+        self._storages = directory.storage, directory.async_storage
+        directory.storage, directory.async_storage = self.storage, SyncStorage(self.storage)
+
+        self.encoding = np.zeros(128)
+        self.ids = self.storage.bulk_new_employees([employee_row(no, self.encoding) for no in ('a', 'b')])
+
+        self.directory = EmployeeDirectory()
+        self.directory.load()
+
+    def tearDown(self):
+        directory.storage, directory.async_storage = self._storages
+
+    def test_load(self):
+        self.assertEqual(len(self.directory), 2)
+        self.assertEqual(self.directory.get('a')['id'], self.ids['a'])
+        self.assertEqual(self.directory.polled_id, max(self.ids.values()))
+
+    def test_poll(self):
+        ids = self.storage.bulk_new_employees([employee_row('c', self.encoding)])
+        self.directory.poll()
+
+        self.assertEqual(self.directory.get('c')['id'], ids['c'])
+        self.assertEqual(self.directory.polled_id, ids['c'])
+
+    def test_local_enrolment_keeps_watermark(self):
+        # another server process commits 'c' before this one enrols 'd'
+        ids = self.storage.bulk_new_employees([employee_row(no, self.encoding) for no in ('c', 'd')])
+        self.directory.put('d', {'id': ids['d'], 'fullname': 'First d', 'english_name': 'Eng d'})
+
+        self.assertIsNone(self.directory.get('c'))
+
+        self.directory.poll()
+        self.assertEqual(self.directory.get('c')['id'], ids['c'])
+
+    def test_full_reload(self):
+        self.directory.put('x', {'id': 1000, 'fullname': 'Not stored', 'english_name': None})
+        self.directory.poll(full=True)
+
+        self.assertEqual(sorted(self.directory.employees), ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import framecache
+
+from framecache import ResultCache, hamming
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self._time, framecache.time = framecache.time, self.clock
+
+        self.cache = ResultCache(size=2, ttl=2, max_distance=3)
+
+    def tearDown(self):
+        framecache.time = self._time
+
+    def test_hamming(self):
+        self.assertEqual(hamming(0b1011, 0b0001), 2)
+        self.assertEqual(hamming(5, 5), 0)
+
+    def test_near_duplicate(self):
+        self.cache.put(0b0000, 'a')
+        self.cache.put(0b1111111, 'b')
+
+        self.assertEqual(self.cache.get(0b0000), 'a')
+        self.assertEqual(self.cache.get(0b0111), 'a')
+        self.assertEqual(self.cache.get(0b1111110), 'b')
+        self.assertIsNone(self.cache.get(0b11110000000))
+
+    def test_replace_and_evict(self):
+        self.cache.put(1, 'a')
+        self.cache.put(1, 'b')
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.get(1), 'b')
+
+        self.cache.put(0b1111 << 10, 'c')
+        self.cache.put(0b1111 << 20, 'd')
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get(1))
+
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_ttl(self):
+        self.cache.put(1, 'a')
+
+        self.clock.now += 1.5
+        self.assertEqual(self.cache.get(1), 'a')
+
+        # a hit doesn't extend the ttl
+        self.clock.now += 1
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(len(self.cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
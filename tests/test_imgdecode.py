@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import cStringIO as StringIO
+import unittest
+import numpy as np
+
+from PIL import Image
+
+from imgdecode import data_url_head, decode_frame, decode_frame_reduced, frame_hash
+
+
+def jpeg(img, quality=90):
+    f = StringIO.StringIO()
+    Image.fromarray(img).save(f, 'JPEG', quality=quality)
+    return f.getvalue()
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class FrameDecoderTest(unittest.TestCase):
+
+    def setUp(self):
+        # smooth noise, like a camera frame
+        noise = np.random.RandomState(0).randint(0, 256, (45, 80, 3)).astype(np.uint8)
+        self.img = np.asarray(Image.fromarray(noise).resize((640, 360), Image.BILINEAR))
+
+        self.frame = jpeg(self.img)
+        self.message = 'head' + self.frame
+        self.data_url = data_url_head + base64.b64encode(self.frame)
+
+    def test_decode(self):
+        img = decode_frame(self.message, 4)
+
+        self.assertEqual(img.shape, (360, 640, 3))
+        self.assertLess(np.abs(img.astype(int) - self.img).mean(), 4)
+        np.testing.assert_array_equal(decode_frame(self.data_url), img)
+
+    def test_decode_reduced(self):
+        small, shape = decode_frame_reduced(self.message, 4, 0.5)
+
+        self.assertEqual((small.shape, shape), ((180, 320, 3), (360, 640)))
+        self.assertLess(np.abs(small.astype(int) - self.img[::2, ::2]).mean(), 16)
+
+        # a scale between two reduced sizes is resized
+        small, _ = decode_frame_reduced(self.data_url, scale=0.4)
+        self.assertEqual(small.shape, (144, 256, 3))
+
+    def test_hash(self):
+        noisy = np.clip(self.img + np.random.RandomState(1).randint(-3, 4, self.img.shape), 0, 255)
+        other = self.img[:, ::-1].copy()
+
+        h = frame_hash(self.message, 4)
+        self.assertEqual(frame_hash(self.data_url), h)
+        self.assertLessEqual(hamming(h, frame_hash(jpeg(noisy.astype(np.uint8), 70), 0)), 6)
+        self.assertGreater(hamming(h, frame_hash(jpeg(other), 0)), 16)
+
+    def test_not_an_image(self):
+        self.assertRaises(IOError, decode_frame, 'head' + 'x' * 100, 4)
+        self.assertRaises(IOError, frame_hash, 'head' + 'x' * 100, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+
+from matcher import AttendantMatcher
+
+
+class AttendantMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.encodings = rng.normal(0, 0.1, (5, 128)).astype(np.float32)
+        self.matcher = AttendantMatcher(['a', 'b', 'c', 'd', 'e'], self.encodings, tolerance=0.6)
+
+    def test_distances(self):
+        faces = self.encodings[[1, 3]] + 0.01
+        expected = np.linalg.norm(faces[:, np.newaxis] - self.encodings, axis=2)
+
+        np.testing.assert_allclose(self.matcher.distances(faces), expected, rtol=1e-4, atol=1e-4)
+
+    def test_match(self):
+        unknown = np.full(128, 1.0, dtype=np.float32)
+        results = self.matcher.match(np.vstack([self.encodings[2], unknown, self.encodings[4] + 0.001]))
+
+        self.assertEqual([no for no, _ in results], ['c', '-1', 'e'])
+        self.assertAlmostEqual(results[0][1], 1.0, places=3)
+        self.assertLess(results[1][1], 1 - 0.6)
+
+    def test_empty(self):
+        self.assertEqual(self.matcher.match([]), [])
+        self.assertEqual(AttendantMatcher([], []).match(self.encodings[:2]), [('-1', 0.0)] * 2)
+        self.assertEqual(len(AttendantMatcher([], [])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+
+import snapshot
+
+from db import SQLiteStorage, encode_reps
+from tests import employee_row
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        # the journal of changes is read from the working directory
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+        self.path = os.path.join(self.directory, 'employees.snap')
+        self.storage = SQLiteStorage()
+        self.encodings = np.random.RandomState(0).normal(0, 0.1, (3, 128)).astype(np.float32)
+        self.ids = self.storage.bulk_new_employees([employee_row(no, encoding)
+                                                    for no, encoding in zip(['a', 'b', 'c'], self.encodings)])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        self.assertEqual(snapshot.write_snapshot(self.path, self.storage), (3, 3))
+
+        snap = snapshot.Snapshot(self.path)
+        self.assertEqual(snap.max_employee_id, max(self.ids.values()))
+        self.assertEqual(snap.employees(), self.storage.load_all_employees())
+
+        ids, nos, encodings = snap.employee_reps()
+        self.assertEqual(dict(zip(nos, ids)), self.ids)
+        np.testing.assert_array_equal(encodings, self.encodings[[['a', 'b', 'c'].index(no) for no in nos]])
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write('\x00' * snapshot.snapshot_header.size)
+
+        self.assertRaises(ValueError, snapshot.Snapshot, self.path)
+
+    def test_empty(self):
+        self.assertEqual(snapshot.write_snapshot(self.path, SQLiteStorage()), (0, 0))
+        self.assertEqual(snapshot.Snapshot(self.path).employee_reps()[2].shape, (0, 128))
+
+    def test_journal(self):
+        since = time.time()
+        snapshot.record_change(1)
+        snapshot.record_change(2)
+
+        self.assertEqual(snapshot.read_changes(since), {1, 2})
+        self.assertEqual(snapshot.read_changes(time.time() + 1), set())
+        self.assertEqual(snapshot.read_changes(since, 'missing.changes'), set())
+
+        # recording can be disabled
+        snapshot.record_change(3, '')
+        self.assertEqual(snapshot.read_changes(since), {1, 2})
+
+    def test_delta_reps(self):
+        snapshot.write_snapshot(self.path, self.storage)
+        snap = snapshot.Snapshot(self.path)
+
+        # an avatar changed and an employee added after the snapshot
+        changed = np.full(128, 0.2, dtype=np.float32)
+        self.storage.change_avatar({'id': [str(self.ids['b'])], 'img': ['']}, encode_reps(changed))
+        snapshot.record_change(self.ids['b'])
+
+        added = self.storage.bulk_new_employees([employee_row('d', np.full(128, 0.3))])
+        snapshot.record_change(added['d'])
+
+        (changed_ids, changed_nos, changed_encodings), (added_ids, added_nos, _) = snap.delta_reps(self.storage)
+
+        self.assertEqual((changed_ids, changed_nos), ([self.ids['b']], ['b']))
+        np.testing.assert_array_equal(changed_encodings[0], changed)
+
+        # a new employee is only returned as added
+        self.assertEqual((added_ids, added_nos), ([added['d']], ['d']))
+
+
+if __name__ == '__main__':
+    unittest.main()
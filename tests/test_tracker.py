@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from tracker import FaceTracker, box_iou, match_tracks
+
+
+class BoxIouTest(unittest.TestCase):
+
+    def test_box_iou(self):
+        self.assertEqual(box_iou((0, 0, 10, 10), (0, 0, 10, 10)), 1.0)
+        self.assertAlmostEqual(box_iou((0, 0, 10, 10), (5, 0, 15, 10)), 1 / 3.0)
+        self.assertEqual(box_iou((0, 0, 10, 10), (10, 0, 20, 10)), 0.0)
+
+
+class MatchTracksTest(unittest.TestCase):
+
+    def test_match(self):
+        tracked = [(0, 0, 10, 10), (100, 100, 110, 110)]
+        faces = [(101, 100, 111, 110), (50, 50, 60, 60), (1, 0, 11, 10)]
+
+        self.assertEqual(match_tracks(faces, tracked, 0.5), [1, None, 0])
+        self.assertEqual(match_tracks(faces, [], 0.5), [None] * 3)
+
+    def test_greedy(self):
+        # the best pair is linked first, a track is linked to one face only
+        tracked = [(0, 0, 10, 10)]
+        self.assertEqual(match_tracks([(2, 0, 12, 10), (1, 0, 11, 10)], tracked, 0.5), [None, 0])
+
+
+class FaceTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = FaceTracker(min_iou=0.5, refresh_interval=2, max_age=1)
+
+    def test_reuse(self):
+        self.assertEqual(self.tracker.reusable_locations(), [])
+        self.assertEqual(self.tracker.update([((0, 0, 10, 10), 'a', 0.9, None)]), [((0, 0, 10, 10), 'a', 0.9)])
+
+        # the classification of a tracked face is reused until it's refreshed
+        for _ in range(2):
+            self.assertEqual(self.tracker.reusable_locations(), [(0, 0, 10, 10)])
+            self.assertEqual(self.tracker.update([((0, 0, 10, 10), None, None, 0)]), [((0, 0, 10, 10), 'a', 0.9)])
+
+        self.assertEqual(self.tracker.reusable_locations(), [])
+
+        # an encoded face refreshes its track
+        self.assertEqual(self.tracker.update([((1, 0, 11, 10), 'b', 0.8, None)]), [((1, 0, 11, 10), 'b', 0.8)])
+        self.assertEqual(len(self.tracker.tracks), 1)
+        self.assertEqual(self.tracker.tracks[0].since_encoded, 0)
+
+    def test_reused_track_not_taken_over(self):
+        self.tracker.reusable_locations()
+        self.tracker.update([((0, 0, 10, 10), 'alice', 0.9, None)])
+        self.tracker.reusable_locations()
+
+        # an encoded face overlapping the reused track is listed first, it starts its own track
+        results = self.tracker.update([((2, 0, 12, 10), 'bob', 0.8, None), ((0, 0, 10, 10), None, None, 0)])
+
+        self.assertEqual(results, [((2, 0, 12, 10), 'bob', 0.8), ((0, 0, 10, 10), 'alice', 0.9)])
+        self.assertEqual(sorted(t.employee_no for t in self.tracker.tracks), ['alice', 'bob'])
+
+    def test_expire(self):
+        self.tracker.reusable_locations()
+        self.tracker.update([((0, 0, 10, 10), 'a', 0.9, None), ((50, 50, 60, 60), 'b', 0.9, None)])
+
+        self.tracker.reusable_locations()
+        self.tracker.update([((50, 50, 60, 60), None, None, 1)])
+        self.assertEqual([t.employee_no for t in self.tracker.tracks], ['a', 'b'])
+
+        self.tracker.reusable_locations()
+        self.tracker.update([])
+        self.assertEqual([t.employee_no for t in self.tracker.tracks], ['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+import os
+import Queue
+import threading
+import time
+import unittest
+
+from twisted.internet import task
+
+from worker import Batcher, FrameScheduler, WorkerError, WorkerPool, WorkerPoolBusy
+
+
+class Reactor(task.Clock):
+    """
+    Fake reactor: delayed calls run when the clock is advanced, calls from other threads when `drain` is called
+    """
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.thread_calls = Queue.Queue()
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.thread_calls.put((f, args, kwargs))
+
+    def addSystemEventTrigger(self, *args, **kwargs):
+        pass
+
+    def drain(self):
+        while True:
+            try:
+                f, args, kwargs = self.thread_calls.get_nowait()
+            except Queue.Empty:
+                return
+
+            f(*args, **kwargs)
+
+
+def run_until(reactor, condition, pool=None, timeout=10.0):
+    """
+    Run the calls of the pool threads, and reap the jobs of a process pool, until `condition()` is true
+    """
+    deadline = time.time() + timeout
+
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+
+        time.sleep(0.01)
+        reactor.drain()
+
+        if pool is not None and pool.kind == 'process':
+            pool._reap()
+
+
+def outcome(d):
+    results = []
+    d.addBoth(results.append)
+
+    return results
+
+
+def double(x):
+    return 2 * x
+
+
+def fail():
+    raise ValueError('bad frame')
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def unpicklable():
+    return lambda: None
+
+
+def die():
+    os._exit(1)
+
+
+def double_all(items):
+    if None in items:
+        raise ValueError('no item')
+
+    return [2 * item for item in items]
+
+
+class ThreadWorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = Reactor()
+        self.pool = WorkerPool('thread', size=1, max_queue=1)
+        self.pool.start(self.reactor)
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_result(self):
+        results = outcome(self.pool.submit(double, 21))
+        run_until(self.reactor, lambda: results)
+
+        self.assertEqual(results, [42])
+        self.assertEqual(self.pool.pending, 0)
+
+    def test_busy(self):
+        event = threading.Event()
+        results = []
+        for _ in range(2):
+            self.pool.submit(event.wait).addBoth(results.append)
+
+        self.assertTrue(self.pool.is_full)
+        self.assertRaises(WorkerPoolBusy, self.pool.submit, double, 1)
+
+        event.set()
+        run_until(self.reactor, lambda: len(results) == 2)
+
+        self.assertEqual(results, [True, True])
+        self.assertEqual(self.pool.pending, 0)
+
+
+class ProcessWorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = Reactor()
+        self.pool = WorkerPool('process', size=2, max_queue=4, timeout=0.5)
+        self.pool.start(self.reactor)
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_result(self):
+        results = outcome(self.pool.submit(double, 21))
+        run_until(self.reactor, lambda: results, self.pool)
+
+        self.assertEqual(results, [42])
+        self.assertEqual(self.pool.pending, 0)
+
+    def test_error(self):
+        results = outcome(self.pool.submit(fail))
+        run_until(self.reactor, lambda: results, self.pool)
+
+        results[0].trap(WorkerError)
+        self.assertIn('bad frame', results[0].getErrorMessage())
+        self.assertEqual(self.pool.pending, 0)
+
+    def test_unpicklable_result(self):
+        # the result can't be sent back, the callback is never called
+        results = outcome(self.pool.submit(unpicklable))
+        run_until(self.reactor, lambda: results, self.pool)
+
+        results[0].trap(WorkerError)
+        self.assertEqual(self.pool.pending, 0)
+
+    def test_timeout(self):
+        results = outcome(self.pool.submit(sleep, 1.5))
+        run_until(self.reactor, lambda: results, self.pool)
+
+        # the Deferred fails early, the job holds its worker until it's done
+        results[0].trap(WorkerError)
+        self.assertEqual(self.pool.pending, 1)
+
+        run_until(self.reactor, lambda: self.pool.pending == 0, self.pool)
+
+    def test_queued_jobs_not_timed(self):
+        # 4 jobs of 0.4 seconds on 2 workers, the last ones wait 0.4 seconds before they run
+        results = [outcome(self.pool.submit(sleep, 0.4)) for _ in range(4)]
+        run_until(self.reactor, lambda: all(results), self.pool)
+
+        self.assertEqual([r[0] for r in results], [0.4] * 4)
+
+    def test_dead_worker(self):
+        results = outcome(self.pool.submit(die))
+        run_until(self.reactor, lambda: results, self.pool)
+
+        results[0].trap(WorkerError)
+
+        # the job is lost with its worker, it isn't counted anymore
+        run_until(self.reactor, lambda: self.pool.pending == 0, self.pool)
+
+        results = outcome(self.pool.submit(double, 1))
+        run_until(self.reactor, lambda: results, self.pool)
+        self.assertEqual(results, [2])
+
+
+class BatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = Reactor()
+        self.pool = WorkerPool('thread', size=1, max_queue=1)
+        self.pool.start(self.reactor)
+
+        self.batches = []
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def batch(self, items):
+        self.batches.append(len(items))
+        return double_all(items)
+
+    def test_no_window(self):
+        batcher = Batcher(self.pool, self.batch, window=0)
+        results = outcome(batcher.submit(1))
+        run_until(self.reactor, lambda: results)
+
+        self.assertEqual((results, self.batches), ([2], [1]))
+
+    def test_window(self):
+        batcher = Batcher(self.pool, self.batch, window=0.05, max_size=8)
+        results = [outcome(batcher.submit(item)) for item in (1, 2, 3)]
+
+        self.assertEqual(self.pool.pending, 0)
+
+        # the items gathered in the window run as one job, each gets its own result
+        self.reactor.advance(0.05)
+        run_until(self.reactor, lambda: all(results))
+
+        self.assertEqual((results, self.batches), ([[2], [4], [6]], [3]))
+
+    def test_max_size(self):
+        batcher = Batcher(self.pool, self.batch, window=10, max_size=2)
+        results = [outcome(batcher.submit(item)) for item in (1, 2, 3)]
+        run_until(self.reactor, lambda: all(results[:2]))
+
+        self.assertEqual(self.batches, [2])
+        self.assertEqual(results[2], [])
+
+        self.reactor.advance(10)
+        run_until(self.reactor, lambda: results[2])
+        self.assertEqual(self.batches, [2, 1])
+
+    def test_failed_batch(self):
+        batcher = Batcher(self.pool, self.batch, window=0.05)
+        results = [outcome(batcher.submit(item)) for item in (1, None)]
+
+        self.reactor.advance(0.05)
+        run_until(self.reactor, lambda: all(results))
+
+        for result in results:
+            result[0].trap(ValueError)
+
+    def test_busy(self):
+        event = threading.Event()
+        for _ in range(2):
+            self.pool.submit(event.wait)
+
+        batcher = Batcher(self.pool, self.batch, window=0.05)
+        self.assertRaises(WorkerPoolBusy, batcher.submit, 1)
+
+        event.set()
+        run_until(self.reactor, lambda: self.pool.pending == 0)
+
+        # items gathered before the pool got full fail when flushed
+        results = outcome(batcher.submit(1))
+        for _ in range(2):
+            self.pool.submit(event.wait)
+
+        self.reactor.advance(0.05)
+        results[0].trap(WorkerPoolBusy)
+
+
+class FrameSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = FrameScheduler()
+
+    def test_idle(self):
+        self.assertEqual(self.frames.push(1), 1)
+        self.assertEqual(self.frames.take(), (None, 0))
+        self.assertFalse(self.frames.busy)
+
+        self.assertEqual(self.frames.push(2), 2)
+
+    def test_latest_frame_wins(self):
+        self.frames.push(1)
+
+        for frame in (2, 3, 4):
+            self.assertIsNone(self.frames.push(frame))
+
+        # the waiting frame is the newest, the two stale ones are counted
+        self.assertEqual(self.frames.take(), (4, 2))
+        self.assertTrue(self.frames.busy)
+
+        self.assertIsNone(self.frames.push(5))
+        self.assertEqual(self.frames.take(), (5, 0))
+        self.assertEqual(self.frames.take(), (None, 0))
+
+    def test_reset(self):
+        self.frames.push(1)
+        self.frames.push(2)
+        self.frames.reset()
+
+        self.assertEqual(self.frames.take(), (None, 0))
+        self.assertEqual(self.frames.push(3), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import conf
+
+tracker_enabled = conf.get_prop('tracker', 'enabled', 'true').lower() == 'true'
+tracker_min_iou = float(conf.get_prop('tracker', 'min_iou', '0.5'))
+tracker_refresh_interval = int(conf.get_prop('tracker', 'refresh_interval', '10'))
+tracker_max_age = int(conf.get_prop('tracker', 'max_age', '3'))
+
+
+def box_iou(css1, css2):
+    """
+    Intersection over union of two face locations in css (left, top, right, bottom) order
+    """
+    w = min(css1[2], css2[2]) - max(css1[0], css2[0])
+    h = min(css1[3], css2[3]) - max(css1[1], css2[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+
+    inter = float(w * h)
+    area1 = (css1[2] - css1[0]) * (css1[3] - css1[1])
+    area2 = (css2[2] - css2[0]) * (css2[3] - css2[1])
+
+    return inter / (area1 + area2 - inter)
+
+
+def match_tracks(face_locations, tracked_locations, min_iou=tracker_min_iou):
+    """
+    Greedily link face locations of a frame to tracked locations of the previous frame by IoU
+    :param face_locations: face locations of the current frame
+    :param tracked_locations: locations of the tracked faces
+    :param min_iou: min IoU of a face and a track to be linked
+    :return: for each face, the index of the linked track or None
+    """
+    matches = [None] * len(face_locations)
+
+    if not tracked_locations:
+        return matches
+
+    pairs = sorted(((box_iou(face, tracked), i, j)
+                    for i, face in enumerate(face_locations)
+                    for j, tracked in enumerate(tracked_locations)), reverse=True)
+
+    used = set()
+    for iou, i, j in pairs:
+        if iou < min_iou:
+            break
+
+        if matches[i] is None and j not in used:
+            matches[i] = j
+            used.add(j)
+
+    return matches
+
+
+class Track(object):
+
+    __slots__ = ('id', 'location', 'employee_no', 'score', 'age', 'since_encoded')
+
+    def __init__(self, track_id, location, employee_no, score):
+        self.id = track_id
+        self.location = location
+        self.employee_no = employee_no
+        self.score = score
+
+        # frames since the face was last seen
+        self.age = 0
+
+        # frames since the face was last encoded
+        self.since_encoded = 0
+
+
+class FaceTracker(object):
+
+    def __init__(self, min_iou=tracker_min_iou, refresh_interval=tracker_refresh_interval, max_age=tracker_max_age):
+        """
+        Track faces of a session across frames, so that a face which barely moves reuses the classification
+        of the previous frames instead of being encoded again.
+        :param min_iou: min IoU of the locations of a face in two frames to be the same face
+        :param refresh_interval: a tracked face is encoded again every `refresh_interval` frames
+        :param max_age: a track expires if the face is not seen for `max_age` frames
+        """
+        self.min_iou = min_iou
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+
+        self.tracks = []
+
+        # tracks offered to the frame being processed
+        self._offered = []
+        self._ids = itertools.count()
+
+    def reusable_locations(self):
+        """
+        Called when a frame is submitted, at most one frame of a session is processed at a time
+        :return: locations of the tracks whose classification can be reused by the next frame
+        """
+        self._offered = [t for t in self.tracks if t.since_encoded < self.refresh_interval]
+        return [t.location for t in self._offered]
+
+    def update(self, faces):
+        """
+        Called when a frame is processed
+        :param faces: a list of (face_location, employee_no, score, track) tuples, track is the index in
+                      `reusable_locations` of a reused face, or None if the face was encoded
+        :return: a list of (face_location, employee_no, score) tuples
+        """
+        seen = set()
+        results = []
+
+        # tracks reused by faces of the frame, whatever their order, can't be taken over by an encoded face
+        claimed = set(self._offered[track].id for _, _, _, track in faces if track is not None)
+
+        for face_location, employee_no, score, track in faces:
+            if track is not None:
+                t = self._offered[track]
+                t.location = face_location
+                t.since_encoded += 1
+            else:
+                # the face was encoded, link it to an existing track or start a new one
+                candidates = [t for t in self.tracks if t.id not in seen and t.id not in claimed]
+                matched = match_tracks([face_location], [t.location for t in candidates], self.min_iou)[0]
+
+                if matched is not None:
+                    t = candidates[matched]
+                    t.location, t.employee_no, t.score = face_location, employee_no, score
+                    t.since_encoded = 0
+                else:
+                    t = Track(next(self._ids), face_location, employee_no, score)
+                    self.tracks.append(t)
+
+            t.age = 0
+            seen.add(t.id)
+            results.append((face_location, t.employee_no, t.score))
+
+        # age the tracks not seen in this frame
+        for t in self.tracks:
+            if t.id not in seen:
+                t.age += 1
+
+        self.tracks = [t for t in self.tracks if t.age <= self.max_age]
+        self._offered = []
+
+        return results
@@ -1,20 +1,55 @@
 # -*- coding: utf-8 -*-
 
+import csv
 import json
 import base64
 import cv2
+import multiprocessing
 import tempfile
 import os
-import numpy as np
 import cStringIO as StringIO
 import uuid
+import zipfile
 
-from PIL import Image
+from twisted.internet import threads
 from twisted.web.resource import Resource
 from twisted.web import server, static
 
-from db import storage
+import ann
+import centroid
+import conf
+import metrics
+import snapshot
+
+from db import async_storage, encode_reps, storage
+from directory import employee_directory
 from face import api
+from imgdecode import decode_frame, decoder
+
+# keep a copy of every uploaded avatar in the temp directory, for debugging
+web_save_avatars = conf.get_prop('web', 'save_avatars', 'false').lower() == 'true'
+
+# processes encoding the avatars of bulk enrollments, in each server process, 0 for the number of cores
+web_enroll_workers = int(conf.get_prop('web', 'enroll_workers', '2'))
+
+
+def employee_stored(employee_id, encoding, employee_no=None, employee=None):
+    """
+    Propagate a face encoding stored in the database to the caches, indexes and models of this process
+    :param employee_no: employee no of a new employee, None for the changed avatar of an employee
+    :param employee: directory entry of a new employee, { 'id', 'fullname', 'english_name' }
+    """
+    storage.invalidate_employee(employee_id)
+
+    if employee_no is None:
+        # snapshots and checkpoints written before are corrected with the journal of changes
+        snapshot.record_change(employee_id)
+
+    ann.add_employee(employee_id, employee_no, encoding)
+    centroid.add_employee(employee_id, employee_no, encoding)
+
+    if employee is not None:
+        employee_directory.put(employee_no, employee)
 
 
 class FaceController(Resource):
@@ -39,33 +74,34 @@ class NewEmployeeController(Resource):
             img_datas = request.args.get('avatar')
 
             if img_datas is not None and len(img_datas) > 0:
-                img = dataurl2img(img_datas[0], True)
+                # detect and encode the face off the reactor thread
+                d = threads.deferToThread(encode_dataurl, img_datas[0])
+                d.addCallback(self.encoded, request)
 
-                # detect faces
-                face_locations = api.detect_faces(img)
+                return render_deferred(request, d)
+            else:
+                return json.dumps({'errno': 100, 'message': 'No avatar found'})
 
-                if len(face_locations) == 0:
-                    return json.dumps({'errno': 101, 'message': 'No face detected'})
+    def encoded(self, result, request):
+        errno, message, encoding = result
+        if errno != 0:
+            return {'errno': errno, 'message': message}
 
-                if len(face_locations) > 1:
-                    return json.dumps({'errno': 102, 'message': 'More than one face detected'})
+        def stored(employee_id):
+            if not employee_id:
+                return {'errno': 300, 'message': 'Internal error'}
 
-                # 128-dimensional face features for each face
-                face_encodings = api.face_encodings(img, known_face_locations=face_locations)
-                if len(face_encodings) == 0:
-                    return json.dumps({'errno': 103, 'message': 'Fail to get the face encodings'})
+            employee_stored(employee_id, encoding, request.args.get('employee_no')[0], {
+                'id': employee_id,
+                'fullname': request.args.get('firstname')[0] + ' ' + request.args.get('lastname')[0],
+                'english_name': request.args.get('engname')[0]
+            })
+            return {'errno': 0}
 
-                # change numpy.ndarray to bytes
-                f = StringIO.StringIO()
-                np.save(f, face_encodings[0])
-                f.seek(0)
+        d = async_storage.new_employee(request.args, encode_reps(encoding))
+        d.addCallback(stored)
 
-                if storage.new_employee(request.args, f.read()):
-                    return json.dumps({'errno': 0})
-                else:
-                    return json.dumps({'errno': 300, 'message': 'Internal error'})
-            else:
-                return json.dumps({'errno': 100, 'message': 'No avatar found'})
+        return d
 
 
 class ChangeAvatarController(Resource):
@@ -81,51 +117,257 @@ class ChangeAvatarController(Resource):
             img_datas = request.args.get('img')
 
             if img_datas is not None and len(img_datas) > 0:
-                img = dataurl2img(img_datas[0], True)
+                # detect and encode the face off the reactor thread
+                d = threads.deferToThread(encode_dataurl, img_datas[0])
+                d.addCallback(self.encoded, request)
+
+                return render_deferred(request, d)
+            else:
+                return json.dumps({'errno': 100, 'message': 'No avatar found'})
+
+    def encoded(self, result, request):
+        errno, message, encoding = result
+        if errno != 0:
+            return {'errno': errno, 'message': message}
+
+        def stored(changed):
+            if not changed:
+                return {'errno': 300, 'message': 'Internal error'}
+
+            employee_stored(int(request.args.get('id')[0]), encoding)
+            return {'errno': 0}
 
-                # detect faces
-                face_locations = api.detect_faces(img)
+        d = async_storage.change_avatar(request.args, encode_reps(encoding))
+        d.addCallback(stored)
 
-                if len(face_locations) == 0:
-                    return json.dumps({'errno': 101, 'message': 'No face detected'})
+        return d
 
-                if len(face_locations) > 1:
-                    return json.dumps({'errno': 102, 'message': 'More than one face detected'})
 
-                # 128-dimensional face features for each face
-                face_encodings = api.face_encodings(img, known_face_locations=face_locations)
-                if len(face_encodings) == 0:
-                    return json.dumps({'errno': 103, 'message': 'Fail to get the face encodings'})
+class InvalidEnrollment(Exception):
+    pass
 
-                # change numpy.ndarray to bytes
-                f = StringIO.StringIO()
-                np.save(f, face_encodings[0])
-                f.seek(0)
 
-                if storage.change_avatar(request.args, f.read()):
-                    return json.dumps({'errno': 0})
+class BulkEnrollController(Resource):
+    """
+    Enroll many employees at once. POST a zip `archive` of avatar images and a `csv` of employees (or an
+    `employees.csv` inside the archive) with the columns employee_no, firstname, lastname, engname, title,
+    group, gender, email and image, the file name of the avatar in the archive.
+    """
+    isLeaf = True
+
+    # employee fields of the csv
+    fields = ('employee_no', 'firstname', 'lastname', 'engname', 'title', 'group', 'gender', 'email')
+
+    def __init__(self, pool, workers):
+        """
+        :param pool: processes encoding the avatars, see `create_enroll_pool`
+        :type pool: multiprocessing.Pool
+        :param workers: number of processes of the pool
+        """
+        Resource.__init__(self)
+
+        self.pool = pool
+        self.workers = workers
+
+    def render(self, request):
+        request.setHeader('Access-Control-Allow-Origin', '*')
+        request.setHeader('Access-Control-Allow-Methods', 'POST')
+        request.setHeader('Access-Control-Allow-Headers', 'x-prototype-version,x-requested-with')
+
+        if request.method == 'POST':
+            archives = request.args.get('archive')
+
+            if archives is not None and len(archives) > 0:
+                # the archive is read and its avatars encoded off the reactor thread
+                d = threads.deferToThread(self.encode, archives[0], (request.args.get('csv') or [None])[0])
+                d.addCallbacks(self.store, self.invalid)
+
+                return render_deferred(request, d)
+            else:
+                return json.dumps({'errno': 100, 'message': 'No archive found'})
+
+    def encode(self, archive, csv_data):
+        """
+        Read an enrollment and encode its avatars across the process pool, it's blocking
+        :return: rows of the csv, avatar images and encoding results
+        """
+        try:
+            rows, images = read_enrollment(archive, csv_data)
+        except (zipfile.BadZipfile, KeyError, csv.Error) as e:
+            raise InvalidEnrollment(str(e))
+
+        return rows, images, self.pool.map(encode_image, images, max(1, len(images) // (self.workers * 4)))
+
+    @staticmethod
+    def invalid(failure):
+        failure.trap(InvalidEnrollment)
+
+        return {'errno': 104, 'message': 'Invalid archive: {}'.format(failure.getErrorMessage())}
+
+    def store(self, result):
+        """
+        Write the employees whose avatar is encoded in one transaction
+        :param result: result of `encode`
+        :return: a Deferred fired with the per-row report
+        """
+        rows, images, encoded = result
+
+        report = []
+        valid = []
+        nos = set()
+
+        for i, (row, image, (errno, message, encoding)) in enumerate(zip(rows, images, encoded)):
+            result = {'row': i + 1, 'employee_no': row.get('employee_no'), 'errno': errno}
+
+            if errno == 0:
+                if any(not row.get(field) for field in self.fields) or not row['gender'].isdigit():
+                    result.update(errno=105, message='Missing or invalid employee fields')
+                elif row['employee_no'] in nos:
+                    result.update(errno=106, message='Duplicated employee no')
                 else:
-                    return json.dumps({'errno': 300, 'message': 'Internal error'})
+                    nos.add(row['employee_no'])
+                    valid.append((result, dict(row, avatar=image_dataurl(row['image'], image),
+                                               reps=encode_reps(encoding)), encoding))
             else:
-                return json.dumps({'errno': 100, 'message': 'No avatar found'})
+                result['message'] = message
 
+            report.append(result)
 
-def dataurl2img(data_url, save_temp_file=False):
-    img_data_header = 'data:image/jpeg;base64,'
+        def stored(ids):
+            for result, row, encoding in valid:
+                employee_id = ids.get(row['employee_no'])
+
+                if employee_id is None:
+                    result.update(errno=107, message='Employee no already exists')
+                    continue
+
+                result['id'] = employee_id
 
-    img_data = base64.b64decode(data_url[len(img_data_header):])
+                employee_stored(employee_id, encoding, row['employee_no'], {
+                    'id': employee_id,
+                    'fullname': row['firstname'] + ' ' + row['lastname'],
+                    'english_name': row['engname']
+                })
 
-    # get file_like object
-    img_file = StringIO.StringIO()
+            return {'errno': 0, 'results': report}
 
-    # write data
-    img_file.write(img_data)
-    img_file.seek(0)
+        d = async_storage.bulk_new_employees([row for _, row, _ in valid])
+        d.addCallback(stored)
 
-    # convert file_like object to array_like object
-    img = Image.open(img_file)
+        return d
 
-    buf = np.asarray(img)
+
+class MetricsController(Resource):
+    """
+    Metrics of this server process in the Prometheus text format
+    """
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+
+        return metrics.registry.render()
+
+
+def read_enrollment(archive, csv_data=None):
+    """
+    :param archive: zip of the avatar images
+    :param csv_data: csv of the employees, read from `employees.csv` in the archive if None
+    :return: rows of the csv, and the avatar image of each row (None if not found in the archive)
+    """
+    with zipfile.ZipFile(StringIO.StringIO(archive)) as z:
+        if csv_data is None:
+            csv_data = z.read('employees.csv')
+
+        rows = list(csv.DictReader(StringIO.StringIO(csv_data)))
+
+        names = set(z.namelist())
+        images = [z.read(row['image']) if row.get('image') in names else None for row in rows]
+
+    return rows, images
+
+
+def encode_image(image):
+    """
+    Face encoding of an avatar, it runs on the enrollment processes
+    :param image: encoded image, e.g. JPEG
+    :return: (errno, message, face encoding)
+    """
+    if image is None:
+        return 100, 'No avatar found', None
+
+    try:
+        img = decoder.decode(image)
+    except IOError:
+        return 108, 'Invalid image', None
+
+    return encode_face(img)
+
+
+def encode_dataurl(data_url):
+    """
+    Face encoding of an avatar data_url, it's blocking
+    :return: (errno, message, face encoding)
+    """
+    return encode_face(dataurl2img(data_url, web_save_avatars))
+
+
+def encode_face(img):
+    """
+    Face encoding of the only face of an image
+    :return: (errno, message, face encoding)
+    """
+    # detect faces
+    face_locations = api.detect_faces(img)
+
+    if len(face_locations) == 0:
+        return 101, 'No face detected', None
+
+    if len(face_locations) > 1:
+        return 102, 'More than one face detected', None
+
+    # 128-dimensional face features for each face
+    face_encodings = api.face_encodings(img, known_face_locations=face_locations)
+    if len(face_encodings) == 0:
+        return 103, 'Fail to get the face encodings', None
+
+    return 0, None, face_encodings[0]
+
+
+def image_dataurl(filename, image):
+    ext = os.path.splitext(filename)[1].lower().lstrip('.')
+
+    return 'data:image/{};base64,{}'.format('jpeg' if ext in ('jpg', 'jpeg') else ext, base64.b64encode(image))
+
+
+def render_deferred(request, d):
+    """
+    Finish a request asynchronously with the json result of a Deferred
+    :return: NOT_DONE_YET
+    """
+    lost = []
+    request.notifyFinish().addErrback(lambda _: lost.append(True))
+
+    def failed(failure):
+        print 'Request failed: {}'.format(failure.getErrorMessage())
+        return {'errno': 300, 'message': 'Internal error'}
+
+    def write(result):
+        if not lost:
+            request.write(json.dumps(result))
+            request.finish()
+
+    d.addErrback(failed)
+    d.addCallback(write)
+
+    return server.NOT_DONE_YET
+
+
+def dataurl2img(data_url, save_temp_file=False):
+    """
+    :return: RGB image
+    """
+    buf = decode_frame(data_url)
 
     if save_temp_file:
         # RGB to BGR
@@ -133,18 +375,36 @@ def dataurl2img(data_url, save_temp_file=False):
         # write to temp file
         cv2.imwrite(os.path.join(tempfile.gettempdir(), str(uuid.uuid1()) + '.jpeg'), temp)
 
-    return buf.copy()
+    return buf
+
+
+def create_enroll_pool(workers=web_enroll_workers):
+    """
+    Fork the processes encoding the avatars of bulk enrollments. Call it before any thread is started: a child
+    inherits the locks held by other threads at fork time, and deadlocks on the first one it takes.
+    :param workers: number of processes, 0 for the number of cores
+    :return: (pool, number of processes)
+    """
+    workers = workers or multiprocessing.cpu_count()
+
+    return multiprocessing.Pool(workers), workers
 
 
-def get_site(root_dir=os.path.expandvars('mego')):
+def get_site(enroll_pool, enroll_workers, root_dir=os.path.expandvars('mego')):
+    """
+    :param enroll_pool: processes encoding the avatars of bulk enrollments, see `create_enroll_pool`
+    :param enroll_workers: number of processes of the pool
+    """
     root = static.File(root_dir)
 
     # init controllers
     face_controller = FaceController()
     face_controller.putChild('new_employee', NewEmployeeController())
     face_controller.putChild('change_employee_avatar', ChangeAvatarController())
+    face_controller.putChild('bulk_enroll', BulkEnrollController(enroll_pool, enroll_workers))
 
     root.putChild("face", face_controller)
+    root.putChild("metrics", MetricsController())
 
     site = server.Site(root)
     return site
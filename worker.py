@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import sys
+import time
+import traceback
+
+from collections import OrderedDict
+
+from twisted.internet import defer, task, threads
+from twisted.python.threadpool import ThreadPool
+
+import metrics
+
+
+class WorkerPoolBusy(Exception):
+    pass
+
+
+class WorkerError(Exception):
+    pass
+
+
+def _call(fn, args, kwargs):
+    """
+    Run a job inside a worker process, exceptions are returned instead of raised because
+    `multiprocessing.Pool.apply_async` has no error callback on python 2
+    """
+    try:
+        return True, fn(*args, **kwargs)
+    except Exception:
+        return False, ''.join(traceback.format_exception(*sys.exc_info()))
+
+
+class _Job(object):
+
+    __slots__ = ('result', 'started', 'expired')
+
+    def __init__(self, result):
+        self.result = result
+
+        # time the job was first seen running on a worker, None while it is queued
+        self.started = None
+
+        # its Deferred was failed by `_reap`, the job still holds a worker until it's ready
+        self.expired = False
+
+
+class WorkerPool(object):
+
+    def __init__(self, kind='thread', size=4, max_queue=16, initializer=None, timeout=30.0):
+        """
+        A pool of workers running blocking jobs off the reactor thread
+        :param kind: 'thread' or 'process'
+        :type kind: str.
+        :param size: number of workers
+        :type size: int.
+        :param max_queue: max number of jobs waiting for a free worker
+        :type max_queue: int.
+        :param initializer: function called by each worker process when it starts, process mode only
+        :param timeout: seconds a job of a worker process may run before its Deferred fails, e.g. because its
+                        process died. It's counted from when the job reaches a worker, and the job stays counted
+                        in `pending` until its worker is done with it. Process mode only, 0 waits forever
+        :type timeout: float.
+        """
+        assert kind in ('thread', 'process')
+        assert size > 0
+
+        self.kind = kind
+        self.size = size
+        self.max_queue = max_queue
+        self.initializer = initializer
+        self.timeout = timeout
+
+        # number of submitted but not finished jobs
+        self.pending = 0
+
+        self.reactor = None
+        self._pool = None
+
+        # Deferred -> _Job of the jobs of the worker processes in submit order, removed once done
+        self._jobs = OrderedDict()
+        self._reaper = None
+
+        # pids of the live worker processes, and number of jobs lost by the ones which died
+        self._workers = set()
+        self._lost = 0
+
+        # results of the expired jobs released as lost, a guess corrected if one of them is ready after all
+        self._released = []
+
+    @property
+    def is_full(self):
+        return self.pending >= self.size + self.max_queue
+
+    def start(self, reactor):
+        self.reactor = reactor
+
+        if self.kind == 'thread':
+            self._pool = ThreadPool(minthreads=self.size, maxthreads=self.size, name='face-worker')
+            self._pool.start()
+        else:
+            self._pool = multiprocessing.Pool(self.size, initializer=self.initializer)
+
+            self._workers = self._alive()
+
+            # a job whose process died or whose result can't be sent back never calls its callback
+            self._reaper = task.LoopingCall(self._reap)
+            self._reaper.clock = reactor
+            self._reaper.start(1, now=False)
+
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        print('Started {} {} workers'.format(self.size, self.kind))
+
+    def stop(self):
+        if self._pool is None:
+            return
+
+        if self.kind == 'thread':
+            self._pool.stop()
+        else:
+            self._reaper.stop()
+            self._pool.terminate()
+
+        self._pool = None
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` on a worker, the function must be picklable in process mode
+        :return: a Deferred fired with the result of the job
+        :raise WorkerPoolBusy: if the queue is full
+        """
+        assert self._pool is not None
+
+        if self.is_full:
+            raise WorkerPoolBusy('{} jobs pending'.format(self.pending))
+
+        self.pending += 1
+
+        # the job returns the timings of its stages along with its result
+        args = (time.time(), fn) + args
+
+        if self.kind == 'thread':
+            d = threads.deferToThreadPool(self.reactor, self._pool, metrics.measured, *args, **kwargs)
+        else:
+            d = defer.Deferred()
+            result = self._pool.apply_async(_call, (metrics.measured, args, kwargs),
+                                            callback=lambda r: self.reactor.callFromThread(self._done, d, r))
+            self._jobs[d] = _Job(result)
+
+        d.addCallback(self._measured)
+
+        if self.kind == 'thread':
+            d.addBoth(self._finished)
+
+        return d
+
+    @staticmethod
+    def _measured(result):
+        result, timings = result
+        metrics.observe(timings)
+
+        return result
+
+    def _done(self, d, result):
+        job = self._jobs.pop(d, None)
+
+        if job is None:
+            # released as lost by `_reap`
+            return
+
+        self.pending -= 1
+
+        if job.expired:
+            # already failed by `_reap`
+            return
+
+        ok, value = result
+
+        if ok:
+            d.callback(value)
+        else:
+            d.errback(WorkerError(value))
+
+    def _alive(self):
+        return set(p.pid for p in self._pool._pool if p.exitcode is None)
+
+    def _release(self, d):
+        del self._jobs[d]
+        self.pending -= 1
+
+    def _reap(self):
+        """
+        Fail the jobs of the worker processes which will never call their callback, or which have been running
+        for more than `timeout` seconds. A job stays counted in `pending` while it holds a worker: until it's
+        ready, or until a worker died and it is the expired job guessed to be lost with it.
+        """
+        now = time.time()
+
+        # a worker that died lost the job it was running, which will never be ready
+        alive = self._alive()
+        self._lost += len(self._workers - alive)
+        self._workers = alive
+
+        # a job released as lost which is ready after all: the lost one is still counted
+        self._lost += sum(1 for result in self._released if result.ready())
+        self._released = [result for result in self._released if not result.ready()]
+
+        running = 0
+
+        for d, job in self._jobs.items():
+            if job.result.ready():
+                if job.result.successful():
+                    # the callback is on its way to the reactor thread
+                    continue
+
+                try:
+                    job.result.get(0)
+                except Exception as e:
+                    self._release(d)
+
+                    if not job.expired:
+                        d.errback(WorkerError('Worker failed: {!r}'.format(e)))
+
+                continue
+
+            # jobs are taken in submit order, the oldest ones not ready hold the workers
+            if running < self.size:
+                running += 1
+
+                if job.started is None:
+                    job.started = now
+
+            if job.started is None or self.timeout <= 0 or now - job.started <= self.timeout:
+                continue
+
+            if not job.expired:
+                job.expired = True
+                d.errback(WorkerError('No result after {:.0f} seconds, the worker may have died'
+                                      .format(now - job.started)))
+
+            if self._lost > 0:
+                self._lost -= 1
+                self._released.append(job.result)
+                self._release(d)
+
+    def _finished(self, result):
+        self.pending -= 1
+        return result
+
+
+class FrameScheduler(object):
+    """
+    Latest-frame-wins scheduling of one session: at most one frame is being processed
+    and at most one frame is waiting, a newer frame replaces the waiting one.
+    """
+
+    def __init__(self):
+        # a frame of the session is being processed
+        self.busy = False
+
+        # the newest frame waiting for processing
+        self.pending = None
+
+        # number of stale frames dropped in favour of the pending one
+        self.coalesced = 0
+
+    def push(self, frame):
+        """
+        :return: the frame if it can be processed right now, otherwise None
+        """
+        if not self.busy:
+            self.busy = True
+            return frame
+
+        if self.pending is not None:
+            self.coalesced += 1
+
+        self.pending = frame
+        return None
+
+    def take(self):
+        """
+        Called when the processing frame is finished
+        :return: (frame, coalesced) of the next frame to process, or (None, 0) if nothing is waiting
+        """
+        frame, coalesced = self.pending, self.coalesced
+
+        self.pending = None
+        self.coalesced = 0
+        self.busy = frame is not None
+
+        return frame, coalesced
+
+    def reset(self):
+        self.busy = False
+        self.pending = None
+        self.coalesced = 0
+
+
+class Batcher(object):
+
+    def __init__(self, pool, fn, window=0.0, max_size=16):
+        """
+        Gather jobs submitted within a short time window and run them as one batch job on the pool
+        :param pool: worker pool
+        :type pool: WorkerPool
+        :param fn: batch function, takes a list of items and returns a list of results in the same order
+        :param window: seconds to wait for more items after the first one, 0 disables batching
+        :type window: float.
+        :param max_size: max number of items in a batch
+        :type max_size: int.
+        """
+        self.pool = pool
+        self.fn = fn
+        self.window = window
+        self.max_size = max_size
+
+        # (item, deferred) of the batch being gathered
+        self._items = []
+        self._call = None
+
+    def submit(self, item):
+        """
+        :return: a Deferred fired with the result of the item
+        :raise WorkerPoolBusy: if the queue of the pool is full
+        """
+        if len(self._items) == 0 and self.pool.is_full:
+            raise WorkerPoolBusy('{} jobs pending'.format(self.pool.pending))
+
+        d = defer.Deferred()
+        self._items.append((item, d))
+
+        if self.window <= 0 or len(self._items) >= self.max_size:
+            self.flush()
+        elif self._call is None:
+            self._call = self.pool.reactor.callLater(self.window, self.flush)
+
+        return d
+
+    def flush(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+        items, self._items = self._items, []
+        if len(items) == 0:
+            return
+
+        try:
+            batch = self.pool.submit(self.fn, [item for item, _ in items])
+        except WorkerPoolBusy as e:
+            for _, d in items:
+                d.errback(e)
+            return
+
+        def dispatch(results):
+            for (_, d), result in zip(items, results):
+                d.callback(result)
+
+        def fail(failure):
+            for _, d in items:
+                d.errback(failure)
+
+        batch.addCallbacks(dispatch, fail)